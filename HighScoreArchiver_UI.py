@@ -1,11 +1,27 @@
+import time
+STARTED = time.perf_counter()  # startup time is measured from here
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
+from tkinter import ttk, messagebox, simpledialog, font, filedialog
 import sqlite3
-import hydrus_api
-from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
+import csv
+import itertools
+import argparse
 import os
-import pyperclip
+import re
+import fnmatch
+import heapq
+import queue
+import threading
+import zlib
+import hashlib
+from array import array
+# hydrus_api, requests, tqdm and pyperclip are imported where they are used, the window doesn't wait for them
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # Constants
 API_URL = "APIURL"
@@ -17,186 +33,2180 @@ TABNAME = "HFH"
 LIMIT = 2048
 DEFAULT_SCORE = 0.1
 DEFAULT_SCORE_INCREMENT = 0.1
+SEARCH_WORKERS = 8
+DELIVERY_CHUNK_SIZE = 256  # files sent to the hydrus page per request
+DELIVERY_RETRIES = 3
+EARLY_DELIVERY = True  # search the highest scored tags first and send files as soon as their place in the top is certain, not yet in rank order
+EARLY_STOP = False  # stop searching once the top files are certain, the tags left only decide their order
+SEEN_FILES = "off"  # "exclude": never send a file to a tab twice, "demote": send files already sent only after all new ones
+SEARCH_PLANNER = "off"  # "exact": OR search groups of tags first and skip the ones nothing matched, "approximate": one OR search per group of same score tags
+PLANNER_GROUP_SIZE = 16
+CHECKPOINT_EVERY = 5.0  # seconds between saving the finished searches of a running search mode run, 0 turns it off
+CLIENT_RANKING = "separate"  # with more clients: "separate" sends every client its own top, "merged" one top over all of them by file hash
+SEARCH_SCOPE = "full"  # "local": tag searches leave out the blacklist / whitelist, their files are kept here instead
+CHEAP_SCOPE = ("system:inbox", "system:archive", "system:import time")  # whitelist predicates "local" still sends, they shrink results and cost hydrus little
+IMPORT_MERGE = "replace"  # a tag that is already in TagScores: "replace" takes the imported row, "keep" the existing one, "add" adds the scores, "max" keeps the higher one
+IMPORT_BATCH_SIZE = 5000  # rows per executemany while importing
+DEFAULT_PROFILE = "default"  # TagScores rows from before profiles existed belong to this one
+COMMIT_DELAY_MS = 500  # score changes are committed once no key was pressed for this long
+RUN_HISTORY_KEEP = 100  # runs kept in RunHistory
+SEARCH_CACHE_TTL = 24 * 60 * 60  # seconds a cached tag search stays valid, 0 disables the cache
+SEARCH_CACHE_BATCH = 50  # new cache rows written per short transaction, so edits during a run don't wait on the cache
+SCORING_MODE = "search"  # "search": one search per tag, "metadata": fetch the candidates once and score them locally
+METADATA_BATCH_SIZE = 256
+ALL_KNOWN_TAGS_SERVICE_KEY = "616c6c206b6e6f776e2074616773"
+
+# Shared Database Connection
+db_connection = None
+db_lock = threading.RLock()
+
+def get_db():
+    # One connection for TagScores reads and writes, shared with the background archiver thread under db_lock
+    global db_connection
+    if db_connection is None:
+        db_connection = sqlite3.connect('db.db', check_same_thread=False)
+        db_connection.execute('PRAGMA journal_mode=WAL')
+    return db_connection
+
+def migrate_tag_scores(cmydb):
+    # Older databases allowed a tag more than once. Duplicates are merged into one row with their scores added
+    # up, because every row used to be searched and counted on its own. Then tag becomes a unique key.
+    cmydb.execute("SELECT name FROM sqlite_master WHERE type='index' AND name IN ('TagScores_tag', 'TagScores_profile_tag')")
+    if cmydb.fetchone():
+        return
+    cmydb.execute('SELECT tag FROM TagScores WHERE tag IS NOT NULL GROUP BY tag HAVING COUNT(*) > 1')
+    for (tag,) in cmydb.fetchall():
+        cmydb.execute('SELECT score, siblings, comment FROM TagScores WHERE tag = ?', (tag,))
+        duplicates = cmydb.fetchall()
+        score = round(sum(DEFAULT_SCORE if row[0] is None else row[0] for row in duplicates), 2)
+        siblings = ", ".join(dict.fromkeys(row[1] for row in duplicates if row[1])) or None
+        comment = " / ".join(dict.fromkeys(row[2] for row in duplicates if row[2])) or None
+        cmydb.execute('DELETE FROM TagScores WHERE tag = ?', (tag,))
+        cmydb.execute("INSERT INTO TagScores (tag, score, siblings, comment) VALUES (?, ?, ?, ?)", (tag, score, siblings, comment))
+    cmydb.execute('CREATE UNIQUE INDEX TagScores_tag ON TagScores (tag)')
+    cmydb.execute('CREATE INDEX IF NOT EXISTS TagScores_score ON TagScores (score)')
+
+def migrate_tag_score_profiles(cmydb):
+    # Every row belongs to a profile, rows from before profiles existed go to the default one.
+    # A tag is unique within its profile instead of the whole table.
+    columns = [row[1] for row in cmydb.execute('PRAGMA table_info(TagScores)').fetchall()]
+    if 'profile' not in columns:
+        cmydb.execute(f"ALTER TABLE TagScores ADD COLUMN profile TEXT NOT NULL DEFAULT '{DEFAULT_PROFILE}'")
+    cmydb.execute('DROP INDEX IF EXISTS TagScores_tag')
+    cmydb.execute('CREATE UNIQUE INDEX IF NOT EXISTS TagScores_profile_tag ON TagScores (profile, tag)')
+    # tabname NULL sends the profile to the Tab Name setting, run marks the profiles Execute runs together
+    cmydb.execute("""
+        CREATE TABLE IF NOT EXISTS Profiles (
+            profile TEXT PRIMARY KEY,
+            tabname TEXT,
+            run INTEGER
+        )
+    """)
+    cmydb.execute('INSERT OR IGNORE INTO Profiles (profile, tabname, run) VALUES (?, NULL, 1)', (DEFAULT_PROFILE,))
 
 # Initialize Database
 def initialize_database():
-    mydb = sqlite3.connect('db.db')
-    cmydb = mydb.cursor()
-    cmydb.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='TagScores'")
-    table_exists = cmydb.fetchone()
-    if not table_exists:
+    with db_lock:
+        mydb = get_db()
+        cmydb = mydb.cursor()
+        cmydb.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='TagScores'")
+        table_exists = cmydb.fetchone()
+        if not table_exists:
+            cmydb.execute("""
+                CREATE TABLE TagScores (
+                    tag TEXT,
+                    score REAL,
+                    siblings TEXT,
+                    comment TEXT
+                )
+            """)
+        migrate_tag_scores(cmydb)
+        migrate_tag_score_profiles(cmydb)
+        # the tree used to write missing values back as the text 'None'
+        cmydb.execute("UPDATE TagScores SET siblings = NULL WHERE siblings = 'None'")
+        cmydb.execute("UPDATE TagScores SET comment = NULL WHERE comment = 'None'")
         cmydb.execute("""
-            CREATE TABLE TagScores (
-                tag TEXT,
-                score REAL,
+            CREATE TABLE IF NOT EXISTS SiblingCache (
+                tag TEXT PRIMARY KEY,
                 siblings TEXT,
-                comment TEXT
+                cached_at REAL
             )
         """)
-    cmydb.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='Settings'")
-    settings_table_exists = cmydb.fetchone()
-    if not settings_table_exists:
+        cmydb.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='SearchCache'")
+        search_cache_exists = cmydb.fetchone()
+        if not search_cache_exists:
+            # query is the full json encoded search, tag_list the blacklist + whitelist it was run with
+            cmydb.execute("""
+                CREATE TABLE SearchCache (
+                    query TEXT PRIMARY KEY,
+                    tag_list TEXT,
+                    file_ids BLOB,
+                    cached_at REAL
+                )
+            """)
         cmydb.execute("""
-            CREATE TABLE Settings (
-                key TEXT PRIMARY KEY,
-                value TEXT
+            CREATE TABLE IF NOT EXISTS RunHistory (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at REAL,
+                mode TEXT,
+                tag_list TEXT,
+                status TEXT,
+                tags INTEGER,
+                searches INTEGER,
+                cached INTEGER,
+                files_scored INTEGER,
+                delivered INTEGER,
+                search_time REAL,
+                sort_time REAL,
+                delivery_time REAL,
+                total_time REAL
             )
         """)
-        # Initialize settings with default values
-        default_settings = [
-            ('API_URL', API_URL),
-            ('ACCESS_KEY', ACCESS_KEY),
-            ('TABNAME', TABNAME),
-            ('LIMIT', str(LIMIT)),
-            ('DEFAULT_SCORE', str(DEFAULT_SCORE)),
-            ('SCORE_INCREMENT', str(DEFAULT_SCORE_INCREMENT)),
-            ('WINDOW_SIZE', '800x600'),
-            ('WINDOW_POSITION', '+100+100'),
-            ('COLUMN_WIDTHS', json.dumps({"Tag": 150, "Score": 100, "Siblings": 150, "Comment": 200})),
-            ('SELECTED_TAB', 'Data'),
-            ('FONT_SIZE', '14'),
-            ('ENTRY_WIDTH', '40'),
-            ('EXAMPLES_POPULATED', 'False')  # Add a flag to indicate if examples have been populated
-        ]
-        cmydb.executemany("INSERT INTO Settings (key, value) VALUES (?, ?)", default_settings)
-    mydb.commit()
-    mydb.close()
+        # query is the json of the searched tag or OR predicate, "base" for the blacklist + whitelist search
+        cmydb.execute("""
+            CREATE TABLE IF NOT EXISTS RunSearches (
+                run_id INTEGER,
+                query TEXT,
+                seconds REAL,
+                file_count INTEGER
+            )
+        """)
+        cmydb.execute('CREATE INDEX IF NOT EXISTS RunSearches_run ON RunSearches (run_id)')
+        # files delivered per profile, target and ranking snapshot, file_ids is a sorted encode_file_ids blob.
+        # target '' is the profile's tab in the main client, file ids of other clients are kept apart
+        columns = [row[1] for row in cmydb.execute('PRAGMA table_info(SeenFiles)').fetchall()]
+        if columns and 'target' not in columns:
+            cmydb.execute('ALTER TABLE SeenFiles RENAME TO SeenFilesOld')
+        cmydb.execute("""
+            CREATE TABLE IF NOT EXISTS SeenFiles (
+                profile TEXT,
+                target TEXT NOT NULL DEFAULT '',
+                fingerprint TEXT,
+                delivered_at REAL,
+                file_ids BLOB,
+                PRIMARY KEY (profile, target, fingerprint)
+            )
+        """)
+        if columns and 'target' not in columns:
+            cmydb.execute('INSERT INTO SeenFiles (profile, fingerprint, delivered_at, file_ids) SELECT profile, fingerprint, delivered_at, file_ids FROM SeenFilesOld')
+            cmydb.execute('DROP TABLE SeenFilesOld')
+        cmydb.execute("""
+            CREATE TABLE IF NOT EXISTS PageKeys (
+                tabname TEXT PRIMARY KEY,
+                page_key TEXT
+            )
+        """)
+        # finished searches of search mode runs that didn't end yet, query '' holds the run's base set.
+        # Checkpoints from before saved_at existed can't be aged, they are dropped
+        columns = [row[1] for row in cmydb.execute('PRAGMA table_info(RunCheckpoints)').fetchall()]
+        if columns and 'saved_at' not in columns:
+            cmydb.execute('DROP TABLE RunCheckpoints')
+        cmydb.execute("""
+            CREATE TABLE IF NOT EXISTS RunCheckpoints (
+                fingerprint TEXT,
+                profile TEXT,
+                query TEXT,
+                score REAL,
+                file_ids BLOB,
+                saved_at REAL,
+                PRIMARY KEY (fingerprint, query)
+            )
+        """)
+        # more tabs a profile's runs fill from the same searches, each with its own limit and extra predicates (json list)
+        cmydb.execute("""
+            CREATE TABLE IF NOT EXISTS Outputs (
+                profile TEXT,
+                tabname TEXT,
+                size_limit INTEGER,
+                predicates TEXT,
+                PRIMARY KEY (profile, tabname)
+            )
+        """)
+        # more hydrus clients Execute runs against besides the one in the settings, tabname NULL is the Tab Name setting
+        cmydb.execute("""
+            CREATE TABLE IF NOT EXISTS Clients (
+                name TEXT PRIMARY KEY,
+                api_url TEXT,
+                access_key TEXT,
+                tabname TEXT
+            )
+        """)
+        cmydb.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='Settings'")
+        settings_table_exists = cmydb.fetchone()
+        if not settings_table_exists:
+            cmydb.execute("""
+                CREATE TABLE Settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            """)
+            # Initialize settings with default values
+            default_settings = [
+                ('API_URL', API_URL),
+                ('ACCESS_KEY', ACCESS_KEY),
+                ('TABNAME', TABNAME),
+                ('LIMIT', str(LIMIT)),
+                ('DEFAULT_SCORE', str(DEFAULT_SCORE)),
+                ('SCORE_INCREMENT', str(DEFAULT_SCORE_INCREMENT)),
+                ('WINDOW_SIZE', '800x600'),
+                ('WINDOW_POSITION', '+100+100'),
+                ('COLUMN_WIDTHS', json.dumps({"Tag": 150, "Score": 100, "Siblings": 150, "Comment": 200})),
+                ('SELECTED_TAB', 'Data'),
+                ('FONT_SIZE', '14'),
+                ('ENTRY_WIDTH', '40'),
+                ('EXAMPLES_POPULATED', 'False'),  # Add a flag to indicate if examples have been populated
+                ('SEARCH_WORKERS', str(SEARCH_WORKERS)),
+                ('SEARCH_CACHE_TTL', str(SEARCH_CACHE_TTL)),
+                ('SCORING_MODE', SCORING_MODE),
+                ('DELIVERY_CHUNK_SIZE', str(DELIVERY_CHUNK_SIZE)),
+                ('EARLY_DELIVERY', str(EARLY_DELIVERY)),
+                ('SEARCH_PLANNER', SEARCH_PLANNER),
+                ('PROFILE', DEFAULT_PROFILE),
+                ('SEEN_FILES', SEEN_FILES),
+                ('EARLY_STOP', str(EARLY_STOP)),
+                ('SEARCH_SCOPE', SEARCH_SCOPE),
+                ('IMPORT_MERGE', IMPORT_MERGE),
+                ('CLIENT_RANKING', CLIENT_RANKING)
+            ]
+            cmydb.executemany("INSERT INTO Settings (key, value) VALUES (?, ?)", default_settings)
+        mydb.commit()
 
 # Populate Database with Examples
 def example_population():
-    mydb = sqlite3.connect('db.db')
-    cmydb = mydb.cursor()
-    example_data = [
-        ('samus aran', 0.3, None, None),
-        ('elf', 0.2, None, "give positive score to things you like"),
-        ('blood', -1.0, None, 'go negative for things you dont like, think how much good stuff it would need to balance it, go high for really bad stuff'),
-        ('system:has audio', 0.1, None, None),
-        ('system:ratio = 16:9', 0.1, None, 'I like files that fit my screen well'),
-        ('science fiction', 0.2, None, '*spaceship noises*'),
-        ('computer', 0.1, None, 'computer for the win!'),
-        ('monochrome', -0.1, None, 'Why does it burn when I see?'),
-        ('greyscale', -0.1, None, 'Why does it burn when I see?'),
-        ('system:has transparency', -0.1, None, 'transparency can be annoying'),
-        ('system:width = 3,840', 0.1, None, 'prefer 4k files'),
-        ('system:height = 2,160', 0.1, None, 'prefer 4k files')
-    ]
-    # Check if example data already exists
-    cmydb.execute('SELECT tag FROM TagScores')
-    existing_tags = {row[0] for row in cmydb.fetchall()}
-    new_data = [data for data in example_data if data[0] not in existing_tags]
-    if new_data:
-        cmydb.executemany("""
-            INSERT INTO TagScores (tag, score, siblings, comment) VALUES (?, ?, ?, ?)
-        """, new_data)
-        mydb.commit()
-    mydb.close()
+    with db_lock:
+        mydb = get_db()
+        cmydb = mydb.cursor()
+        example_data = [
+            ('samus aran', 0.3, None, None),
+            ('elf', 0.2, None, "give positive score to things you like"),
+            ('blood', -1.0, None, 'go negative for things you dont like, think how much good stuff it would need to balance it, go high for really bad stuff'),
+            ('system:has audio', 0.1, None, None),
+            ('system:ratio = 16:9', 0.1, None, 'I like files that fit my screen well'),
+            ('science fiction', 0.2, None, '*spaceship noises*'),
+            ('computer', 0.1, None, 'computer for the win!'),
+            ('monochrome', -0.1, 'greyscale', 'Why does it burn when I see?'),
+            ('system:has transparency', -0.1, None, 'transparency can be annoying'),
+            ('system:width = 3,840', 0.1, None, 'prefer 4k files'),
+            ('system:height = 2,160', 0.1, None, 'prefer 4k files')
+        ]
+        # Check if example data already exists
+        cmydb.execute('SELECT tag FROM TagScores WHERE profile = ?', (DEFAULT_PROFILE,))
+        existing_tags = {row[0] for row in cmydb.fetchall()}
+        new_data = [data for data in example_data if data[0] not in existing_tags]
+        if new_data:
+            cmydb.executemany("""
+                INSERT INTO TagScores (tag, score, siblings, comment) VALUES (?, ?, ?, ?)
+            """, new_data)
+            mydb.commit()
 
 # Load Database Contents
-def load_database_contents():
-    mydb = sqlite3.connect('db.db')
-    cmydb = mydb.cursor()
-    cmydb.execute('SELECT * FROM TagScores')
-    rows = cmydb.fetchall()
-    mydb.close()
-    return rows
+def load_database_contents(profile=DEFAULT_PROFILE):
+    with db_lock:
+        return get_db().execute('SELECT tag, score, siblings, comment FROM TagScores WHERE profile = ?', (profile,)).fetchall()
 
 # Save Database Changes
-def save_database_changes(rows):
-    mydb = sqlite3.connect('db.db')
-    cmydb = mydb.cursor()
-    cmydb.execute('DELETE FROM TagScores')
-    cmydb.executemany("""
-        INSERT INTO TagScores (tag, score, siblings, comment) VALUES (?, ?, ?, ?)
-    """, rows)
-    mydb.commit()
-    mydb.close()
+def save_database_changes(rows, profile=DEFAULT_PROFILE):
+    # Replaces the whole profile, single edits should use upsert_tag_score / delete_tag_score
+    with db_lock:
+        mydb = get_db()
+        mydb.execute('DELETE FROM TagScores WHERE profile = ?', (profile,))
+        mydb.executemany("""
+            INSERT INTO TagScores (tag, score, siblings, comment, profile) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(profile, tag) DO UPDATE SET score = excluded.score, siblings = excluded.siblings, comment = excluded.comment
+        """, [tuple(row) + (profile,) for row in rows])
+        mydb.commit()
+
+def upsert_tag_score(tag, score, siblings, comment, commit=True, profile=DEFAULT_PROFILE):
+    with db_lock:
+        mydb = get_db()
+        mydb.execute("""
+            INSERT INTO TagScores (tag, score, siblings, comment, profile) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(profile, tag) DO UPDATE SET score = excluded.score, siblings = excluded.siblings, comment = excluded.comment
+        """, (tag, score, siblings, comment, profile))
+        if commit:
+            mydb.commit()
+
+def delete_tag_score(tag, commit=True, profile=DEFAULT_PROFILE):
+    with db_lock:
+        mydb = get_db()
+        mydb.execute('DELETE FROM TagScores WHERE tag = ? AND profile = ?', (tag, profile))
+        if commit:
+            mydb.commit()
+
+# Profiles
+def load_profiles():
+    # [(profile, tabname, run)], tabname None means the Tab Name setting
+    with db_lock:
+        return get_db().execute('SELECT profile, tabname, run FROM Profiles ORDER BY profile').fetchall()
+
+def save_profile(profile, tabname, run):
+    with db_lock:
+        mydb = get_db()
+        mydb.execute('REPLACE INTO Profiles (profile, tabname, run) VALUES (?, ?, ?)', (profile, tabname, int(run)))
+        mydb.commit()
+
+def delete_profile(profile):
+    with db_lock:
+        mydb = get_db()
+        mydb.execute('DELETE FROM TagScores WHERE profile = ?', (profile,))
+        mydb.execute('DELETE FROM Profiles WHERE profile = ?', (profile,))
+        mydb.execute('DELETE FROM Outputs WHERE profile = ?', (profile,))
+        mydb.commit()
+
+# Clients
+def load_clients():
+    # [(name, api_url, access_key, tabname)] of the extra hydrus clients
+    with db_lock:
+        return get_db().execute('SELECT name, api_url, access_key, tabname FROM Clients ORDER BY name').fetchall()
+
+def save_client(name, api_url, access_key, tabname):
+    with db_lock:
+        mydb = get_db()
+        mydb.execute('REPLACE INTO Clients (name, api_url, access_key, tabname) VALUES (?, ?, ?, ?)', (name, api_url, access_key, tabname))
+        mydb.commit()
+
+def delete_client(name):
+    with db_lock:
+        mydb = get_db()
+        mydb.execute('DELETE FROM Clients WHERE name = ?', (name,))
+        mydb.commit()
+
+# Outputs
+def load_outputs(profile=DEFAULT_PROFILE):
+    # [(tabname, limit, [predicates])] of the profile's extra tabs
+    with db_lock:
+        rows = get_db().execute('SELECT tabname, size_limit, predicates FROM Outputs WHERE profile = ? ORDER BY tabname', (profile,)).fetchall()
+    return [(tabname, size_limit, json.loads(predicates)) for tabname, size_limit, predicates in rows]
+
+def save_output(profile, tabname, limit, predicates):
+    with db_lock:
+        mydb = get_db()
+        mydb.execute('REPLACE INTO Outputs (profile, tabname, size_limit, predicates) VALUES (?, ?, ?, ?)', (profile, tabname, limit, json.dumps(predicates)))
+        mydb.commit()
+
+def delete_output(profile, tabname):
+    with db_lock:
+        mydb = get_db()
+        mydb.execute('DELETE FROM Outputs WHERE profile = ? AND tabname = ?', (profile, tabname))
+        mydb.commit()
+
+def parse_predicates(text):
+    # The predicates of an output as typed, separated by ";" since system predicates can hold commas
+    return [predicate for predicate in dict.fromkeys(part.strip() for part in text.split(";")) if predicate]
+
+# Import / Export
+TAG_SCORE_FIELDS = ("tag", "score", "siblings", "comment")
+# what an imported row does to an existing row of the same tag, an empty score counts as 0 when adding
+MERGE_UPDATES = {
+    "replace": "score = excluded.score, siblings = COALESCE(excluded.siblings, siblings), comment = COALESCE(excluded.comment, comment)",
+    "keep": None,
+    "add": "score = IFNULL(score, 0) + IFNULL(excluded.score, 0), siblings = COALESCE(siblings, excluded.siblings), comment = COALESCE(comment, excluded.comment)",
+    "max": "score = MAX(COALESCE(score, excluded.score), COALESCE(excluded.score, score)), siblings = COALESCE(siblings, excluded.siblings), comment = COALESCE(comment, excluded.comment)",
+}
+
+def tag_score_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in (".csv", ".json", ".jsonl"):
+        raise ValueError(f"Unknown file type '{extension}', use .csv, .json or .jsonl")
+    return extension
+
+def iter_json_array(handle, chunk_size=1 << 16):
+    # Yields the items of a JSON array one by one, reading the file in chunks instead of all at once
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    started = False
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position == len(buffer):
+            if eof:
+                raise ValueError("The JSON array is not closed")
+            buffer = handle.read(chunk_size)
+            position = 0
+            eof = not buffer
+            continue
+        if not started:
+            if buffer[position] != "[":
+                raise ValueError("A .json file has to hold an array of tag rows")
+            started = True
+            position += 1
+            continue
+        if buffer[position] == "]":
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # the item goes on in the next chunk
+            if eof:
+                raise
+            more = handle.read(chunk_size)
+            eof = not more
+            buffer = buffer[position:] + more
+            position = 0
+            continue
+        yield item
+
+def parse_tag_score(values):
+    # (tag, score, siblings, comment) from a dict or list of them, empty values become None
+    if isinstance(values, dict):
+        values = [values.get(field) for field in TAG_SCORE_FIELDS]
+    values = (list(values) + [None] * len(TAG_SCORE_FIELDS))[:len(TAG_SCORE_FIELDS)]
+    tag, score, siblings, comment = [value.strip() if isinstance(value, str) else value for value in values]
+    if not tag:
+        return None
+    return tag, None if score in (None, "") else float(score), siblings or None, comment or None
+
+def read_tag_scores(path):
+    # Yields the rows of a .csv (with a header line), .json (array) or .jsonl file, a row at a time
+    extension = tag_score_format(path)
+    with open(path, newline='', encoding='utf-8') as handle:
+        if extension == ".csv":
+            items = csv.DictReader(handle)
+            if items.fieldnames is None or "tag" not in items.fieldnames:
+                raise ValueError("The first line of a .csv file has to name its columns, one of them 'tag'")
+        elif extension == ".json":
+            items = iter_json_array(handle)
+        else:
+            items = (json.loads(line) for line in handle if line.strip())
+        for item in items:
+            row = parse_tag_score(item)
+            if row is not None:
+                yield row
+
+def import_tag_scores(path, merge=IMPORT_MERGE, profile=DEFAULT_PROFILE, batch_size=IMPORT_BATCH_SIZE):
+    # Streams the file into TagScores in one transaction, nothing is changed if a row can't be read.
+    # Returns how many rows were read.
+    if merge not in MERGE_UPDATES:
+        raise ValueError(f"Unknown merge policy '{merge}', use one of {', '.join(MERGE_UPDATES)}")
+    update = MERGE_UPDATES[merge]
+    statement = "INSERT INTO TagScores (tag, score, siblings, comment, profile) VALUES (?, ?, ?, ?, ?) ON CONFLICT(profile, tag) "
+    statement += f"DO UPDATE SET {update}" if update else "DO NOTHING"
+    rows = ((tag, score, siblings, comment, profile) for tag, score, siblings, comment in read_tag_scores(path))
+    count = 0
+    with db_lock:
+        mydb = get_db()
+        try:
+            mydb.execute('INSERT OR IGNORE INTO Profiles (profile, tabname, run) VALUES (?, NULL, 0)', (profile,))
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+                mydb.executemany(statement, batch)
+                count += len(batch)
+            mydb.commit()
+        except Exception:
+            mydb.rollback()
+            raise
+    return count
+
+def export_tag_scores(path, profile=DEFAULT_PROFILE):
+    # Writes the profile's rows to a .csv, .json or .jsonl file as they are read, returns how many
+    extension = tag_score_format(path)
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as handle:
+        if extension == ".csv":
+            writer = csv.writer(handle)
+            writer.writerow(TAG_SCORE_FIELDS)
+        elif extension == ".json":
+            handle.write("[")
+        last_tag = None
+        while True:
+            # pages of rows by tag, the shared connection is only held while one page is read
+            with db_lock:
+                rows = get_db().execute('SELECT tag, score, siblings, comment FROM TagScores WHERE profile = ? AND (? IS NULL OR tag > ?) ORDER BY tag LIMIT ?',
+                                        (profile, last_tag, last_tag, IMPORT_BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+            last_tag = rows[-1][0]
+            for row in rows:
+                if extension == ".csv":
+                    writer.writerow(["" if value is None else value for value in row])
+                else:
+                    line = json.dumps(dict(zip(TAG_SCORE_FIELDS, row)), ensure_ascii=False)
+                    if extension == ".json":
+                        line = ("," if count else "") + "\n  " + line
+                    handle.write(line if extension == ".json" else line + "\n")
+                count += 1
+        if extension == ".json":
+            handle.write("\n]\n")
+    return count
+
+def commit_database():
+    with db_lock:
+        get_db().commit()
 
 # Save Settings to Database
-def save_settings_to_db(api_url, access_key, tabname, limit, default_score, score_increment, window_size, window_position, column_widths, selected_tab, font_size, entry_width, examples_populated):
-    mydb = sqlite3.connect('db.db')
-    cmydb = mydb.cursor()
-    settings = [
-        ('API_URL', api_url),
-        ('ACCESS_KEY', access_key),
-        ('TABNAME', tabname),
-        ('LIMIT', str(limit)),
-        ('DEFAULT_SCORE', str(default_score)),
-        ('SCORE_INCREMENT', str(score_increment)),
-        ('WINDOW_SIZE', window_size),
-        ('WINDOW_POSITION', window_position),
-        ('COLUMN_WIDTHS', json.dumps(column_widths)),
-        ('SELECTED_TAB', selected_tab),
-        ('FONT_SIZE', str(font_size)),
-        ('ENTRY_WIDTH', str(entry_width)),
-        ('EXAMPLES_POPULATED', examples_populated)  # Update the flag
-    ]
-    for key, value in settings:
-        cmydb.execute("REPLACE INTO Settings (key, value) VALUES (?, ?)", (key, value))
-    mydb.commit()
-    mydb.close()
+def save_settings_to_db(api_url, access_key, tabname, limit, default_score, score_increment, window_size, window_position, column_widths, selected_tab, font_size, entry_width, examples_populated, search_workers=SEARCH_WORKERS, search_cache_ttl=SEARCH_CACHE_TTL, scoring_mode=SCORING_MODE, delivery_chunk_size=DELIVERY_CHUNK_SIZE, early_delivery=EARLY_DELIVERY, search_planner=SEARCH_PLANNER, profile=DEFAULT_PROFILE, seen_files=SEEN_FILES, early_stop=EARLY_STOP, search_scope=SEARCH_SCOPE, import_merge=IMPORT_MERGE, client_ranking=CLIENT_RANKING):
+    with db_lock:
+        mydb = get_db()
+        cmydb = mydb.cursor()
+        settings = [
+            ('API_URL', api_url),
+            ('ACCESS_KEY', access_key),
+            ('TABNAME', tabname),
+            ('LIMIT', str(limit)),
+            ('DEFAULT_SCORE', str(default_score)),
+            ('SCORE_INCREMENT', str(score_increment)),
+            ('WINDOW_SIZE', window_size),
+            ('WINDOW_POSITION', window_position),
+            ('COLUMN_WIDTHS', json.dumps(column_widths)),
+            ('SELECTED_TAB', selected_tab),
+            ('FONT_SIZE', str(font_size)),
+            ('ENTRY_WIDTH', str(entry_width)),
+            ('EXAMPLES_POPULATED', examples_populated),  # Update the flag
+            ('SEARCH_WORKERS', str(search_workers)),
+            ('SEARCH_CACHE_TTL', str(search_cache_ttl)),
+            ('SCORING_MODE', scoring_mode),
+            ('DELIVERY_CHUNK_SIZE', str(delivery_chunk_size)),
+            ('EARLY_DELIVERY', str(early_delivery)),
+            ('SEARCH_PLANNER', search_planner),
+            ('PROFILE', profile),
+            ('SEEN_FILES', seen_files),
+            ('EARLY_STOP', str(early_stop)),
+            ('SEARCH_SCOPE', search_scope),
+            ('IMPORT_MERGE', import_merge),
+            ('CLIENT_RANKING', client_ranking)
+        ]
+        for key, value in settings:
+            cmydb.execute("REPLACE INTO Settings (key, value) VALUES (?, ?)", (key, value))
+        mydb.commit()
 
 # Load Settings from Database
 def load_settings_from_db():
-    mydb = sqlite3.connect('db.db')
-    cmydb = mydb.cursor()
-    cmydb.execute('SELECT key, value FROM Settings')
-    settings = {row[0]: row[1] for row in cmydb.fetchall()}
-    mydb.close()
-    return settings
+    with db_lock:
+        mydb = get_db()
+        cmydb = mydb.cursor()
+        cmydb.execute('SELECT key, value FROM Settings')
+        settings = {row[0]: row[1] for row in cmydb.fetchall()}
+        return settings
+
+def save_setting(key, value):
+    with db_lock:
+        mydb = get_db()
+        mydb.execute("REPLACE INTO Settings (key, value) VALUES (?, ?)", (key, value))
+        mydb.commit()
 
-# DB High Score Archiver
-def db_high_score_archiver(client, blacklist, whitelist, limit, tabname):
-    def find_page_key(tabs, tabname):
-        if 'pages' in tabs and isinstance(tabs['pages'], list):
-            for page in tabs['pages']:
-                if page.get('name') == tabname:
-                    return page.get('page_key')
-                if 'pages' in page and isinstance(page['pages'], list):
-                    sub_page_key = find_page_key(page, tabname)
-                    if sub_page_key:
-                        return sub_page_key
-        return None
+# Run Statistics
+class RunStats:
+    # What a run cost in hydrus round trips and time, shown when the run is done and kept in RunHistory
+    def __init__(self):
+        self.tag_searches = 0  # searches one search per tag would have needed
+        self.cached = 0  # of those, answered from the search cache (counted in tags like tag_searches)
+        self.searches = 0  # tag searches actually sent to hydrus
+        self.max_over = 0.0  # approximate planner: most a file can score above exact scoring
+        self.max_under = 0.0  # and below it
+        self.skipped = 0  # of those, left out because they could not change the top anymore (in tags too)
+        self.resumed = 0  # searches taken over from an interrupted run
+        self.started_at = time.time()
+        self.search_log = []  # (query json, seconds, files returned) of every search sent to hydrus
+        self.phase_times = {}  # "search", "sort", "delivery", "total" -> seconds
+        self.files_scored = 0
+        self.delivered = 0
+
+    def record_search(self, query, seconds, file_count):
+        self.search_log.append((json.dumps(query), seconds, file_count))
+
+    def add_time(self, phase, seconds):
+        self.phase_times[phase] = self.phase_times.get(phase, 0.0) + seconds
+
+    def merge(self, other, name):
+        # Counts of a run against another client, its searches are logged with the client's name in front
+        for counter in ("tag_searches", "cached", "searches", "skipped", "files_scored", "delivered"):
+            setattr(self, counter, getattr(self, counter) + getattr(other, counter))
+        self.max_over = max(self.max_over, other.max_over)
+        self.max_under = max(self.max_under, other.max_under)
+        self.search_log.extend((f"{name}: {query}", seconds, file_count) for query, seconds, file_count in other.search_log)
+
+    def summary(self):
+        # searches still running when a run stopped early are sent but count as skipped too
+        saved = max(0, self.tag_searches - self.cached - self.searches - self.skipped)
+        text = f"{self.searches} searches for {self.tag_searches} tags ({self.cached} cached, planner saved {saved})."
+        if self.max_over or self.max_under:
+            text += f" Approximate scores are off by at most +{self.max_over:g} / -{self.max_under:g}."
+        if self.skipped:
+            text += f" Stopped early, {self.skipped} searches skipped."
+        if self.resumed:
+            text += f" Resumed {self.resumed} searches of an interrupted run."
+        return text
+
+    def timing(self):
+        phases = ", ".join(f"{phase} {self.phase_times[phase]:.1f} s" for phase in ("search", "sort", "delivery") if phase in self.phase_times)
+        return f"Took {self.phase_times.get('total', 0.0):.1f} s ({phases})."
+
+def timed_search(client, query):
+    # search_files and how long hydrus took to answer it
+    started = time.perf_counter()
+    file_ids = client.search_files(query, file_sort_type=13)
+    return file_ids, time.perf_counter() - started
+
+# Run History
+def save_run_history(stats, mode, tag_list, status):
+    # One RunHistory row per run and a RunSearches row per search it sent, only the last RUN_HISTORY_KEEP runs are kept
+    with db_lock:
+        mydb = get_db()
+        cursor = mydb.execute("""
+            INSERT INTO RunHistory (started_at, mode, tag_list, status, tags, searches, cached, files_scored, delivered, search_time, sort_time, delivery_time, total_time)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (stats.started_at, mode, json.dumps(tag_list), status, stats.tag_searches, stats.searches, stats.cached, stats.files_scored, stats.delivered,
+              stats.phase_times.get("search"), stats.phase_times.get("sort"), stats.phase_times.get("delivery"), stats.phase_times.get("total")))
+        run_id = cursor.lastrowid
+        mydb.executemany("INSERT INTO RunSearches (run_id, query, seconds, file_count) VALUES (?, ?, ?, ?)", [(run_id,) + entry for entry in stats.search_log])
+        mydb.execute("DELETE FROM RunHistory WHERE run_id <= ?", (run_id - RUN_HISTORY_KEEP,))
+        mydb.execute("DELETE FROM RunSearches WHERE run_id <= ?", (run_id - RUN_HISTORY_KEEP,))
+        mydb.commit()
+    return run_id
+
+def load_run_history():
+    with db_lock:
+        return get_db().execute("""
+            SELECT run_id, started_at, mode, status, searches, cached, files_scored, delivered, search_time, sort_time, delivery_time, total_time
+            FROM RunHistory ORDER BY run_id DESC
+        """).fetchall()
+
+def load_run_searches(run_id):
+    # Slowest searches of a run first
+    with db_lock:
+        return get_db().execute('SELECT query, seconds, file_count FROM RunSearches WHERE run_id = ? ORDER BY seconds DESC', (run_id,)).fetchall()
+
+# Concurrent Tag Search
+def search_tags_concurrently(client, queries, workers=SEARCH_WORKERS, pbar=None, stats=None):
+    # Searches run on a thread pool, results are yielded in query order so scores add up like the serial loop.
+    # If the caller stops early (error or cancel) searches that haven't started yet are dropped.
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    futures = {}
+    try:
+        futures = {executor.submit(timed_search, client, query): index for index, query in enumerate(queries)}
+        finished = {}
+        next_index = 0
+        for future in as_completed(futures):
+            index = futures[future]
+            file_ids, seconds = future.result()
+            finished[index] = file_ids
+            if stats is not None:
+                stats.record_search(queries[index][0], seconds, len(file_ids))
+            if pbar is not None:
+                pbar.update(1)
+            while next_index in finished:
+                yield next_index, finished.pop(next_index)
+                next_index += 1
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        if stats is not None:
+            # searches dropped before they started were never sent
+            stats.searches += sum(1 for future in futures if not future.cancelled())
+
+# Search Planner
+def yield_chunks(sequence, size):
+    # like hydrus_api.utils.yield_chunks
+    for start in range(0, len(sequence), size):
+        yield sequence[start:start + size]
+
+def merge_predicates(predicates):
+    # One OR predicate matching any of the given tags or OR predicates
+    merged = []
+    for predicate in predicates:
+        merged.extend(predicate if isinstance(predicate, list) else [predicate])
+    return list(dict.fromkeys(merged))
+
+def search_tags_grouped(client, queries, workers=SEARCH_WORKERS, pbar=None, stats=None, group_size=PLANNER_GROUP_SIZE):
+    # Exact planner: searches OR groups of group_size tags first. Tags of a group that matched nothing are known
+    # to match nothing, only the tags of groups with results are searched one by one. Yields like
+    # search_tags_concurrently, so per file totals are exactly the ones of per tag searches.
+    # System predicates are searched on their own, like the approximate planner keeps them out of its groups.
+    if group_size < 2 or len(queries) < 2:
+        yield from search_tags_concurrently(client, queries, workers, pbar, stats)
+        return
+    system = [index for index, query in enumerate(queries) if isinstance(query[0], str) and query[0].startswith("system:")]
+    groupable = sorted(set(range(len(queries))) - set(system))
+    groups = list(yield_chunks(groupable, group_size))
+    group_queries = [[merge_predicates([queries[index][0] for index in group])] + queries[group[0]][1:] for group in groups]
+    if pbar is not None:
+        pbar.total += len(group_queries)
+        pbar.refresh()
+    individual = list(system)
+    known = {}
+    for position, file_ids in search_tags_concurrently(client, group_queries, workers, pbar, stats):
+        group = groups[position]
+        if not file_ids:
+            continue
+        if len(group) == 1:
+            # a group of one tag is that tag's search
+            known[group[0]] = file_ids
+        else:
+            individual.extend(group)
+    if pbar is not None:
+        # tags of empty groups are done without a search of their own
+        pbar.update(len(queries) - len(individual))
+    # search_tags_concurrently yields in the order it got the queries, the merge below needs them ascending
+    individual.sort()
+    next_index = 0
+    for position, file_ids in search_tags_concurrently(client, [queries[index] for index in individual], workers, pbar, stats):
+        index = individual[position]
+        while next_index < index:
+            yield next_index, known.pop(next_index, [])
+            next_index += 1
+        yield index, file_ids
+        next_index = index + 1
+    while next_index < len(queries):
+        yield next_index, known.pop(next_index, [])
+        next_index += 1
+
+# Search Cache
+def encode_file_ids(file_ids):
+    # Delta encoded 64 bit ids, compressed. Keeps the order hydrus returned them in
+    if np is not None:
+        return zlib.compress(np.diff(np.asarray(file_ids, dtype=np.int64), prepend=0).tobytes())
+    deltas = array('q', file_ids)
+    for i in range(len(deltas) - 1, 0, -1):
+        deltas[i] -= deltas[i - 1]
+    return zlib.compress(deltas.tobytes())
+
+def decode_file_ids(blob):
+    if np is not None:
+        return np.cumsum(np.frombuffer(zlib.decompress(blob), dtype=np.int64)).tolist()
+    file_ids = array('q')
+    file_ids.frombytes(zlib.decompress(blob))
+    for i in range(1, len(file_ids)):
+        file_ids[i] += file_ids[i - 1]
+    return file_ids.tolist()
+
+def clear_search_cache(tag_list=None):
+    with db_lock:
+        mydb = get_db()
+        if tag_list is None:
+            mydb.execute('DELETE FROM SearchCache')
+        else:
+            mydb.execute('DELETE FROM SearchCache WHERE tag_list = ?', (json.dumps(tag_list),))
+        mydb.commit()
 
-    def display_error(title, message):
-        messagebox.showerror(title, message)
+def search_tags_cached(client, queries, tag_list, workers=SEARCH_WORKERS, pbar=None, ttl=SEARCH_CACHE_TTL, base_ids=None, stats=None, group_size=0, restrict=False, sizes=None):
+    # Like search_tags_concurrently, but only asks hydrus for queries that are not cached or older than ttl.
+    # The base query (blacklist + whitelist alone) is searched every run: if it gained files since the last run
+    # (new imports) every cached result for this tag_list is dropped, if it only lost files (archived) the
+    # cached results are still valid once they are filtered down to the current base set.
+    # With group_size the queries that aren't cached go through the exact planner. With restrict the queries don't
+    # carry the whole tag_list (local search scope), their results are cut down to the base set before use.
+    # sizes are the tags each query stands for, the cached ones are counted in tags.
+    # The cache goes through get_db() under db_lock in short transactions, never across a yield, so score edits
+    # and checkpoints written while the searches run don't wait for it.
+    if ttl <= 0:
+        base = FileIdSet(base_ids) if restrict else None
+        for index, file_ids in search_tags_grouped(client, queries, workers, pbar, stats, group_size):
+            yield index, base.keep(file_ids) if restrict else file_ids
+        return
+    key = json.dumps(tag_list)
+    now = time.time()
+    if base_ids is None:
+        base_ids, seconds = timed_search(client, tag_list)
+        if stats is not None:
+            stats.record_search("base", seconds, len(base_ids))
+    base_set = set(base_ids)
+    base = FileIdSet(base_ids) if restrict else None
+    with db_lock:
+        mydb = get_db()
+        # Results cached for another blacklist / whitelist can never be hit again
+        mydb.execute('DELETE FROM SearchCache WHERE tag_list != ? OR cached_at < ?', (key, now - ttl))
+        previous_base = mydb.execute('SELECT file_ids FROM SearchCache WHERE query = ?', (key,)).fetchone()
+        if previous_base is None or not base_set.issubset(decode_file_ids(previous_base[0])):
+            mydb.execute('DELETE FROM SearchCache WHERE tag_list = ?', (key,))
+        mydb.execute("REPLACE INTO SearchCache (query, tag_list, file_ids, cached_at) VALUES (?, ?, ?, ?)", (key, key, encode_file_ids(base_ids), now))
+        mydb.commit()
+        stored = dict(mydb.execute('SELECT query, file_ids FROM SearchCache WHERE tag_list = ?', (key,)).fetchall())
+    cached = {}
+    for index, query in enumerate(queries):
+        blob = stored.get(json.dumps(query))
+        if blob is not None:
+            cached[index] = [file_id for file_id in decode_file_ids(blob) if file_id in base_set]
+    if pbar is not None and cached:
+        pbar.update(len(cached))
+    if stats is not None:
+        stats.cached += sum(sizes[index] for index in cached) if sizes is not None else len(cached)
+    missing = [index for index in range(len(queries)) if index not in cached]
+    new_rows = []
+
+    def write_new_rows():
+        if new_rows:
+            with db_lock:
+                mydb = get_db()
+                mydb.executemany("REPLACE INTO SearchCache (query, tag_list, file_ids, cached_at) VALUES (?, ?, ?, ?)", new_rows)
+                mydb.commit()
+            new_rows.clear()
 
     try:
-        ScoreAndIDs = {}
-        pbar = tqdm(total=len(load_database_contents()), desc="Processing DB Tags", miniters=10, ncols=80)
-        if blacklist:
-            for tag in blacklist:
-                blacklist[blacklist.index(tag)] = "-" + tag
-        tag_list = blacklist + whitelist
-        for row in load_database_contents():
-            tag, score, _, _ = row
-            if score is None:
-                score = DEFAULT_SCORE
-            query = [tag] + tag_list
-            file_ids = client.search_files(query, file_sort_type=13)
-            for file_id in file_ids:
-                if file_id not in ScoreAndIDs:
-                    ScoreAndIDs[file_id] = score
-                else:
-                    ScoreAndIDs[file_id] += score
-            pbar.update(1)
-        pbar.close()
+        next_index = 0
+        for position, file_ids in search_tags_grouped(client, [queries[index] for index in missing], workers, pbar, stats, group_size):
+            index = missing[position]
+            if restrict:
+                file_ids = base.keep(file_ids)
+            new_rows.append((json.dumps(queries[index]), key, encode_file_ids(file_ids), time.time()))
+            if len(new_rows) >= SEARCH_CACHE_BATCH:
+                write_new_rows()
+            while next_index < index:
+                yield next_index, cached.pop(next_index)
+                next_index += 1
+            yield index, file_ids
+            next_index = index + 1
+        while next_index < len(queries):
+            yield next_index, cached.pop(next_index)
+            next_index += 1
+    finally:
+        write_new_rows()
+
+# Score Accumulator
+class ScoreAccumulator:
+    # Adds up tag scores per file id in typed arrays and selects the top files without sorting everything.
+    # Uses NumPy when it is installed and plain python arrays otherwise, both rank ties by first appearance
+    # like sorting the old ScoreAndIDs dict did. hits counts how many tags matched a file, so a file whose
+    # tags were all taken away again drops out of the ranking.
+    def __init__(self, compact_every=1 << 22):
+        self.compact_every = compact_every
+        if np is not None:
+            self.ids = np.empty(0, dtype=np.int64)
+            self.scores = np.empty(0, dtype=np.float64)
+            self.first_seen = np.empty(0, dtype=np.int64)
+            self.hits = np.empty(0, dtype=np.int64)
+            self.pending_ids = []
+            self.pending_scores = []
+            self.pending_hits = []
+            self.pending_size = 0
+            self.added = 0
+        else:
+            self.ids = array('q')
+            self.scores = array('d')
+            self.hits = array('q')
+            self.positions = {}
+
+    def add(self, file_ids, score, hits=1):
+        # score is one number for all file_ids or one number per file id
+        per_file = isinstance(score, (list, tuple, array)) or (np is not None and isinstance(score, np.ndarray))
+        if np is not None:
+            file_ids = np.asarray(file_ids, dtype=np.int64)
+            if per_file:
+                scores = np.asarray(score, dtype=np.float64)
+            else:
+                scores = np.full(len(file_ids), score, dtype=np.float64)
+            self.pending_ids.append(file_ids)
+            self.pending_scores.append(scores)
+            self.pending_hits.append(np.full(len(file_ids), hits, dtype=np.int64))
+            self.pending_size += len(file_ids)
+            if self.pending_size >= self.compact_every:
+                self.compact()
+            return
+        positions = self.positions
+        scores = self.scores
+        for i, file_id in enumerate(file_ids):
+            value = score[i] if per_file else score
+            position = positions.get(file_id)
+            if position is None:
+                positions[file_id] = len(self.ids)
+                self.ids.append(file_id)
+                scores.append(value)
+                self.hits.append(hits)
+            else:
+                scores[position] += value
+                self.hits[position] += hits
 
-        sorted_file_ids = sorted(ScoreAndIDs.items(), key=lambda x: x[1], reverse=True)
-        top_file_ids = [file_id for file_id, score in sorted_file_ids[:limit]]
+    def compact(self):
+        # Merges all pending results in one step, bincount adds in insertion order so totals match the dict loop
+        if np is None or not self.pending_size:
+            return
+        ids = np.concatenate([self.ids] + self.pending_ids)
+        scores = np.concatenate([self.scores] + self.pending_scores)
+        hits = np.concatenate([self.hits] + self.pending_hits)
+        order = np.concatenate([self.first_seen, np.arange(self.added, self.added + self.pending_size, dtype=np.int64)])
+        self.ids, first_index, inverse = np.unique(ids, return_index=True, return_inverse=True)
+        self.scores = np.bincount(inverse, weights=scores, minlength=len(self.ids))
+        self.hits = np.bincount(inverse, weights=hits, minlength=len(self.ids)).astype(np.int64)
+        self.first_seen = order[first_index]
+        self.added += self.pending_size
+        self.pending_ids = []
+        self.pending_scores = []
+        self.pending_hits = []
+        self.pending_size = 0
+
+    def __len__(self):
+        self.compact()
+        if np is not None:
+            return int(np.count_nonzero(self.hits))
+        return sum(1 for hits in self.hits if hits)
+
+    def items(self):
+        self.compact()
+        if np is not None:
+            order = np.argsort(self.first_seen, kind='stable')
+            order = order[self.hits[order] > 0]
+            return zip(self.ids[order].tolist(), self.scores[order].tolist())
+        return ((file_id, score) for file_id, score, hits in zip(self.ids, self.scores, self.hits) if hits)
+
+    def top(self, limit, with_scores=False, exclude=None, keep=None):
+        # File ids of the `limit` highest scores, highest first. with_scores gives (file_id, score) pairs.
+        # Files in exclude (a FileIdSet) are left out, with keep (a FileIdSet) only files in it are ranked
+        self.compact()
+        if np is not None:
+            candidates = np.nonzero(self.hits > 0)[0]
+            if exclude is not None and len(exclude):
+                candidates = candidates[~exclude.mask(self.ids[candidates])]
+            if keep is not None:
+                candidates = candidates[keep.mask(self.ids[candidates])]
+            scores = self.scores[candidates]
+            if len(candidates) > limit > 0:
+                kth = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+                keep = scores >= kth
+                candidates = candidates[keep]
+                scores = scores[keep]
+            order = np.lexsort((self.first_seen[candidates], -scores))
+            selected = candidates[order][:max(0, limit)]
+            if with_scores:
+                return list(zip(self.ids[selected].tolist(), self.scores[selected].tolist()))
+            return self.ids[selected].tolist()
+        scores = self.scores
+        hits = self.hits
+        if keep is not None:
+            ids = self.ids
+            exclude = exclude if exclude is not None else FileIdSet()
+            selected = heapq.nlargest(limit, (i for i in range(len(ids)) if hits[i] and ids[i] in keep and ids[i] not in exclude), key=scores.__getitem__)
+        elif exclude is not None and len(exclude):
+            ids = self.ids
+            selected = heapq.nlargest(limit, (i for i in range(len(ids)) if hits[i] and ids[i] not in exclude), key=scores.__getitem__)
+        else:
+            selected = heapq.nlargest(limit, (i for i in range(len(self.ids)) if hits[i]), key=scores.__getitem__)
+        if with_scores:
+            return [(self.ids[i], scores[i]) for i in selected]
+        return [self.ids[i] for i in selected]
+
+# Seen Files
+class FileIdSet:
+    # A set of file ids as one sorted NumPy array (or a set without NumPy), so keeping or leaving them out of
+    # a list of files is a sorted set operation even with millions of them. Used for files already delivered
+    # to a tab and for the blacklist / whitelist base set
+    def __init__(self, file_ids=()):
+        if np is not None:
+            self.ids = np.unique(np.asarray(file_ids, dtype=np.int64))
+        else:
+            self.ids = set(file_ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, file_id):
+        if np is not None:
+            position = np.searchsorted(self.ids, file_id)
+            return bool(position < len(self.ids) and self.ids[position] == file_id)
+        return file_id in self.ids
+
+    def mask(self, file_ids):
+        # NumPy only: which of the (unique) file_ids are in the set
+        return np.isin(file_ids, self.ids, assume_unique=True)
+
+    def filter(self, file_ids):
+        # file_ids without the ones in the set, in their order
+        if np is not None and len(file_ids):
+            file_ids = np.asarray(file_ids, dtype=np.int64)
+            return file_ids[~np.isin(file_ids, self.ids)].tolist()
+        return [file_id for file_id in file_ids if file_id not in self]
+
+    def keep(self, file_ids):
+        # only the file_ids in the set, in their order
+        if np is not None and len(file_ids):
+            file_ids = np.asarray(file_ids, dtype=np.int64)
+            return file_ids[np.isin(file_ids, self.ids)].tolist()
+        return [file_id for file_id in file_ids if file_id in self]
+
+def ranking_fingerprint(rows, tag_list):
+    # Identifies the TagScores rows + blacklist / whitelist a delivery was ranked with
+    return hashlib.sha1(json.dumps([sorted(rows, key=str), tag_list]).encode()).hexdigest()
+
+def load_seen_files(profile=DEFAULT_PROFILE, target=''):
+    # Everything ever delivered to the profile's target, over all ranking snapshots
+    with db_lock:
+        blobs = get_db().execute('SELECT file_ids FROM SeenFiles WHERE profile = ? AND target = ?', (profile, target)).fetchall()
+    file_ids = []
+    for (blob,) in blobs:
+        file_ids.extend(decode_file_ids(blob))
+    return FileIdSet(file_ids)
+
+def record_seen_files(profile, fingerprint, file_ids, target=''):
+    # Delivered files are added to the snapshot of the ranking they came from, stored sorted so they compress well
+    if not len(file_ids):
+        return
+    with db_lock:
+        mydb = get_db()
+        row = mydb.execute('SELECT file_ids FROM SeenFiles WHERE profile = ? AND target = ? AND fingerprint = ?', (profile, target, fingerprint)).fetchone()
+        if row is not None:
+            file_ids = list(file_ids) + decode_file_ids(row[0])
+        file_ids = FileIdSet(file_ids).ids
+        if np is None:
+            file_ids = sorted(file_ids)
+        mydb.execute('REPLACE INTO SeenFiles (profile, target, fingerprint, delivered_at, file_ids) VALUES (?, ?, ?, ?, ?)',
+                     (profile, target, fingerprint, time.time(), encode_file_ids(file_ids)))
+        mydb.commit()
 
-        page_key = find_page_key(client.get_pages(), tabname)
+def clear_seen_files(profile=None):
+    with db_lock:
+        mydb = get_db()
+        if profile is None:
+            mydb.execute('DELETE FROM SeenFiles')
+        else:
+            mydb.execute('DELETE FROM SeenFiles WHERE profile = ?', (profile,))
+        mydb.commit()
+
+def rank_with_seen(scores, limit, seen, seen_mode, keep=None):
+    # "exclude": only files not delivered before, "demote": those first, then seen files fill up to limit.
+    # keep (a FileIdSet) limits the ranking to the files of an output's predicates
+    if seen_mode == "off" or not len(seen):
+        return scores.top(limit, keep=keep)
+    ranked = scores.top(limit, exclude=seen, keep=keep)
+    if seen_mode == "demote" and len(ranked) < limit:
+        # fewer than limit unseen files, so the best seen ones are all in the overall top
+        unseen = set(ranked)
+        ranked += [file_id for file_id in scores.top(limit, keep=keep) if file_id not in unseen][:limit - len(ranked)]
+    return ranked
+
+# Siblings
+def parse_siblings(tag, siblings):
+    # The Siblings column holds comma separated tags that mean the same as tag
+    if not siblings:
+        return []
+    return [sibling for sibling in dict.fromkeys(part.strip() for part in siblings.split(",")) if sibling and sibling != tag]
+
+def tag_predicate(tag, siblings):
+    # A tag with siblings becomes one hydrus OR predicate, so it costs one search and counts once per file
+    alternatives = parse_siblings(tag, siblings)
+    return [tag] + alternatives if alternatives else tag
+
+def get_siblings_and_parents(client, tags):
+    # hydrus_api 4.0.0 has no method for this endpoint, so it is called through the client's request helper.
+    # Hydrus answers 404 if its Client API is too old to have it
+    import hydrus_api
+    if hasattr(client, "get_siblings_and_parents"):
+        return client.get_siblings_and_parents(tags)
+    try:
+        return client._api_request("GET", "/add_tags/get_siblings_and_parents", params={"tags": json.dumps(tags)}).json()
+    except hydrus_api.APIError as e:
+        if getattr(e.response, "status_code", None) == 404:
+            raise ValueError("This hydrus client has no /add_tags/get_siblings_and_parents, update hydrus to use Fill Siblings.") from e
+        raise
+
+def lookup_hydrus_siblings(client, tags, batch_size=100, ttl=SEARCH_CACHE_TTL):
+    # Returns {tag: [siblings]} from hydrus' sibling data, cached in SiblingCache so a tag is only asked for once per ttl
+    found = {}
+    with db_lock:
+        mydb = get_db()
+        mydb.execute('DELETE FROM SiblingCache WHERE cached_at < ?', (time.time() - ttl,))
+        mydb.commit()
+        for tag in tags:
+            cached = mydb.execute('SELECT siblings FROM SiblingCache WHERE tag = ?', (tag,)).fetchone()
+            if cached is not None:
+                found[tag] = json.loads(cached[0])
+    missing = [tag for tag in tags if tag not in found and not tag.startswith("system:")]
+    for chunk in yield_chunks(missing, batch_size):
+        response = get_siblings_and_parents(client, chunk)
+        for tag in chunk:
+            siblings = set()
+            for service in response.get("tags", {}).get(tag, {}).values():
+                siblings.update(service.get("siblings", []))
+            siblings.discard(tag)
+            found[tag] = sorted(siblings)
+        with db_lock:
+            mydb = get_db()
+            mydb.executemany("REPLACE INTO SiblingCache (tag, siblings, cached_at) VALUES (?, ?, ?)", [(tag, json.dumps(found[tag]), time.time()) for tag in chunk])
+            mydb.commit()
+    return found
+
+# Incremental Ranking
+class RankingState:
+    # What the last search mode run learned: the files each query returned and the score they were counted
+    # with. The next run only applies score deltas, searches new queries and subtracts removed ones.
+    def __init__(self):
+        self.reset()
+
+    def reset(self, tag_list=None):
+        self.tag_list = tag_list
+        self.base_ids = None
+        self.results = {}  # query json -> array('q') of file ids
+        self.query_scores = {}  # query json -> score it was added with
+        self.searched_at = {}  # query json -> time.time() of the search its results came from
+        self.scores = ScoreAccumulator()
+        self.pending = []  # [(key, query, score)] a run that stopped early did not search, not part of scores
+        self.sizes = {}  # query json -> how many tags it stands for, to count skipped searches in tags
+
+    def rebuild(self, base_set):
+        # Files left the base set (archived), recount everything locally from the stored results
+        self.scores = ScoreAccumulator()
+        for key, score in self.query_scores.items():
+            results = array('q', [file_id for file_id in self.results[key] if file_id in base_set])
+            self.results[key] = results
+            self.scores.add(results, score)
+
+class RunCheckpoint:
+    # Saves the searches a run finished to RunCheckpoints as it goes, so the next run after a crash, a closed window
+    # or an error only searches the rest. Runs with the same profile, blacklist / whitelist, planner and scope share
+    # a checkpoint, changed scores and tags are taken care of by prepare_ranking like between two normal runs.
+    # Searches older than ttl are not restored, like stored results in a RankingState.
+    def __init__(self, profile, tag_list, planner=SEARCH_PLANNER, scope=SEARCH_SCOPE, every=CHECKPOINT_EVERY, ttl=SEARCH_CACHE_TTL):
+        self.fingerprint = hashlib.sha1(json.dumps([profile, tag_list, planner, scope]).encode()).hexdigest()
+        self.profile = profile
+        self.every = every
+        self.ttl = ttl
+        self.buffer = []
+        self.saved_at = time.monotonic()
+
+    def restore(self, state, tag_list):
+        # Puts the saved searches that aren't expired into an empty state, returns how many
+        if self.ttl <= 0:
+            return 0
+        with db_lock:
+            rows = get_db().execute("SELECT query, score, file_ids, saved_at FROM RunCheckpoints WHERE fingerprint = ? AND (query = '' OR saved_at >= ?)",
+                                    (self.fingerprint, time.time() - self.ttl)).fetchall()
+        base = [decode_file_ids(file_ids) for query, score, file_ids, saved_at in rows if query == '']
+        if not base:
+            return 0
+        state.reset(tag_list)
+        state.base_ids = set(base[0])
+        for query, score, file_ids, saved_at in rows:
+            if query:
+                state.results[query] = array('q', decode_file_ids(file_ids))
+                state.query_scores[query] = score
+                state.searched_at[query] = saved_at
+                state.scores.add(state.results[query], score)
+        return len(state.query_scores)
+
+    def start(self, base_ids):
+        # Files imported since the checkpoint make its results incomplete, then it starts over. Checkpoints of the
+        # profile under another fingerprint (blacklist, planner or scope changed since) can't be resumed anymore
+        with db_lock:
+            mydb = get_db()
+            mydb.execute('DELETE FROM RunCheckpoints WHERE profile = ? AND fingerprint != ?', (self.profile, self.fingerprint))
+            row = mydb.execute("SELECT file_ids FROM RunCheckpoints WHERE fingerprint = ? AND query = ''", (self.fingerprint,)).fetchone()
+            if row is None or not set(base_ids).issubset(decode_file_ids(row[0])):
+                mydb.execute('DELETE FROM RunCheckpoints WHERE fingerprint = ?', (self.fingerprint,))
+                mydb.execute("INSERT INTO RunCheckpoints (fingerprint, profile, query, score, file_ids, saved_at) VALUES (?, ?, '', NULL, ?, ?)",
+                             (self.fingerprint, self.profile, encode_file_ids(base_ids), time.time()))
+            mydb.commit()
+
+    def add(self, key, score, file_ids):
+        self.buffer.append((self.fingerprint, self.profile, key, score, encode_file_ids(file_ids), time.time()))
+        if self.every > 0 and time.monotonic() - self.saved_at >= self.every:
+            self.save()
+
+    def save(self):
+        if self.buffer:
+            with db_lock:
+                mydb = get_db()
+                mydb.executemany('REPLACE INTO RunCheckpoints (fingerprint, profile, query, score, file_ids, saved_at) VALUES (?, ?, ?, ?, ?, ?)', self.buffer)
+                mydb.commit()
+            self.buffer = []
+        self.saved_at = time.monotonic()
+
+    def clear(self):
+        # the run finished, its ranking state lives on in memory
+        self.buffer = []
+        with db_lock:
+            mydb = get_db()
+            mydb.execute('DELETE FROM RunCheckpoints WHERE fingerprint = ?', (self.fingerprint,))
+            mydb.commit()
+
+def stable_prefix(ranked, limit, remaining_positive, remaining_negative):
+    # How many of the current best files are certain to stay in the top `limit`: every one of them can still lose
+    # at most remaining_negative, everything below them (also files not seen yet, at 0) gain at most remaining_positive
+    for j in range(min(limit, len(ranked)), 0, -1):
+        below = max(ranked[j][1], 0.0) if j < len(ranked) else 0.0
+        if ranked[j - 1][1] + remaining_negative > below + remaining_positive + 1e-9:
+            return j
+    return 0
+
+def plan_queries(rows, tag_list, planner=SEARCH_PLANNER, group_size=PLANNER_GROUP_SIZE, stats=None):
+    # {query json: (query, score, number of tags)} for the TagScores rows. The approximate planner puts tags with
+    # the same score into OR searches of up to group_size tags: a file matching several of them counts once.
+    predicates = []
+    for row in rows:
+        tag, score = row[0], row[1]
+        if score is None:
+            score = DEFAULT_SCORE
+        predicates.append((tag_predicate(tag, row[2]), score, tag.startswith("system:")))
+    if planner == "approximate" and group_size > 1:
+        by_score = {}
+        grouped = []
+        for predicate, score, is_system in predicates:
+            if is_system:
+                grouped.append((predicate, score, 1))
+            else:
+                by_score.setdefault(score, []).append(predicate)
+        for score, same_score in by_score.items():
+            for chunk in yield_chunks(same_score, group_size):
+                grouped.append((merge_predicates(chunk) if len(chunk) > 1 else chunk[0], score, len(chunk)))
+                if stats is not None and score > 0:
+                    stats.max_under += score * (len(chunk) - 1)
+                elif stats is not None:
+                    stats.max_over += -score * (len(chunk) - 1)
+        predicates = grouped
+    else:
+        predicates = [(predicate, score, 1) for predicate, score, is_system in predicates]
+    planned = {}
+    for predicate, score, size in predicates:
+        query = [predicate] + tag_list
+        key = json.dumps(query)
+        if key in planned:
+            planned[key] = (query, planned[key][1] + score, planned[key][2] + size)
+        else:
+            planned[key] = (query, score, size)
+    return planned
+
+def search_base(client, tag_list, stats=None):
+    # The blacklist + whitelist search every tag query is restricted by
+    base_ids, seconds = timed_search(client, tag_list)
+    if stats is not None:
+        stats.record_search("base", seconds, len(base_ids))
+    return base_ids
+
+def query_scope(tag_list, scope=SEARCH_SCOPE):
+    # What goes into every tag query after the tag. "full" sends the whole blacklist + whitelist, so hydrus checks
+    # it again for every tag, "local" only the cheap predicates and the results are cut down to the base set here
+    if scope == "full":
+        return tag_list
+    return [predicate for predicate in tag_list if predicate.startswith(CHEAP_SCOPE)]
+
+def prepare_ranking(state, planned, tag_list, base_set, ttl=SEARCH_CACHE_TTL):
+    # Applies everything to state that needs no search, returns the [(key, query, score)] that still have to be searched.
+    # The base set tells us if files were imported (start over) or archived (recount locally). Results older than
+    # ttl are dropped and searched again, tags added to files in hydrus would never show up otherwise.
+    if state.tag_list != tag_list or state.base_ids is None or not base_set.issubset(state.base_ids):
+        state.reset(tag_list)
+    elif len(base_set) < len(state.base_ids):
+        state.rebuild(base_set)
+    state.base_ids = base_set
+
+    expired = time.time() - ttl
+    for key in list(state.query_scores):
+        if key not in planned or ttl <= 0 or state.searched_at.get(key, 0) < expired:
+            state.scores.add(state.results.pop(key), -state.query_scores.pop(key), hits=-1)
+            state.searched_at.pop(key, None)
+    for key, (query, score, size) in planned.items():
+        if key in state.query_scores and score != state.query_scores[key]:
+            state.scores.add(state.results[key], score - state.query_scores[key], hits=0)
+            state.query_scores[key] = score
+    return [(key, query, score) for key, (query, score, size) in planned.items() if key not in state.query_scores]
+
+def update_rankings(client, states, rows_by_profile, tag_list, workers=SEARCH_WORKERS, pbar=None, cache_ttl=SEARCH_CACHE_TTL, stats=None, planner=SEARCH_PLANNER, group_size=PLANNER_GROUP_SIZE, scope=SEARCH_SCOPE):
+    # update_ranking for several profiles at once: a query that more than one profile needs is searched once and
+    # counted into each of them with that profile's score, so the cost grows with the distinct tags, not the profiles
+    base_ids = search_base(client, tag_list, stats)
+    base_set = set(base_ids)
+    needed = {}  # query json -> (query, [(profile, score)])
+    sizes = {}
+    for profile, rows in rows_by_profile.items():
+        planned = plan_queries(rows, query_scope(tag_list, scope), planner, group_size, stats)
+        for key, query, score in prepare_ranking(states[profile], planned, tag_list, base_set, cache_ttl):
+            needed.setdefault(key, (query, []))[1].append((profile, score))
+            sizes[key] = max(sizes.get(key, 0), planned[key][2])
+    new_queries = list(needed.items())
+    if stats is not None:
+        stats.tag_searches += sum(sizes.values())
+    if pbar is not None:
+        pbar.total = len(new_queries)
+        pbar.refresh()
+    exact_group_size = group_size if planner == "exact" else 0
+    results = search_tags_cached(client, [query for key, (query, users) in new_queries], tag_list, workers, pbar, cache_ttl, base_ids, stats, exact_group_size, scope != "full", [sizes[key] for key, (query, users) in new_queries])
+    for index, file_ids in results:
+        key, (query, users) = new_queries[index]
+        shared = array('q', file_ids)
+        for profile, score in users:
+            state = states[profile]
+            state.results[key] = shared
+            state.query_scores[key] = score
+            state.searched_at[key] = time.time()
+            state.scores.add(shared, score)
+    return len(new_queries)
+
+def update_ranking(client, state, rows, tag_list, workers=SEARCH_WORKERS, pbar=None, cache_ttl=SEARCH_CACHE_TTL, limit=LIMIT, on_stable=None, stats=None, planner=SEARCH_PLANNER, group_size=PLANNER_GROUP_SIZE, stop_early=False, exclude=None, scope=SEARCH_SCOPE, checkpoint=None, ranking_ttl=None):
+    # Brings state up to date with the TagScores rows, returns how many queries had to be searched.
+    # Stored results older than ranking_ttl (cache_ttl unless given) are searched again.
+    # With on_stable the new queries are searched highest absolute score first and on_stable gets the files
+    # whose place in the top `limit` is already certain, while the rest is still being searched. Only their
+    # membership is certain, not their rank: the order they come in can still change.
+    # With stop_early searching ends once all of the top `limit` (without the files in exclude) is certain or only
+    # negative queries are left, those go to state.pending and order_stopped_top picks the exact top from them.
+    # With a checkpoint every finished search is also saved to it.
+    planned = plan_queries(rows, query_scope(tag_list, scope), planner, group_size, stats)
+    base_ids = search_base(client, tag_list, stats)
+    if checkpoint is not None:
+        checkpoint.start(base_ids)
+    new_queries = prepare_ranking(state, planned, tag_list, set(base_ids), cache_ttl if ranking_ttl is None else ranking_ttl)
+    state.pending = []
+    state.sizes = {key: size for key, (query, score, size) in planned.items()}
+    if stats is not None:
+        stats.tag_searches += sum(planned[key][2] for key, query, score in new_queries)
+    if stop_early:
+        # positive queries first: once only negative ones are left, they are checked on the best files only
+        new_queries.sort(key=lambda planned_query: (planned_query[2] <= 0, -abs(planned_query[2])))
+    elif on_stable is not None:
+        new_queries.sort(key=lambda planned_query: -abs(planned_query[2]))
+    remaining_positive = sum(score for key, query, score in new_queries if score > 0)
+    remaining_negative = sum(score for key, query, score in new_queries if score < 0)
+    check_every = max(1, len(new_queries) // (50 if stop_early else 20))
+    stable = 0
+    if pbar is not None:
+        pbar.total = len(new_queries)
+        pbar.refresh()
+    exact_group_size = group_size if planner == "exact" else 0
+    results = search_tags_cached(client, [query for key, query, score in new_queries], tag_list, workers, pbar, cache_ttl, base_ids, stats, exact_group_size, scope != "full", [planned[key][2] for key, query, score in new_queries])
+    try:
+        for index, file_ids in results:
+            key, query, score = new_queries[index]
+            state.results[key] = array('q', file_ids)
+            state.query_scores[key] = score
+            state.searched_at[key] = time.time()
+            state.scores.add(file_ids, score)
+            if checkpoint is not None:
+                checkpoint.add(key, score, file_ids)
+            if score > 0:
+                remaining_positive -= score
+            else:
+                remaining_negative -= score
+            if index + 1 >= len(new_queries):
+                continue
+            if stop_early and remaining_positive <= 1e-9:
+                state.pending = new_queries[index + 1:]
+                break
+            if (index + 1) % check_every != 0:
+                continue
+            if on_stable is not None and stable < limit:
+                ranked = state.scores.top(limit + 1, with_scores=True)
+                now_stable = stable_prefix(ranked, limit, remaining_positive, remaining_negative)
+                if now_stable > stable:
+                    stable = now_stable
+                    on_stable([file_id for file_id, file_score in ranked[:stable]])
+            if stop_early:
+                ranked = state.scores.top(limit + 1, with_scores=True, exclude=exclude)
+                if len(ranked) >= limit and stable_prefix(ranked, limit, remaining_positive, remaining_negative) == limit:
+                    state.pending = new_queries[index + 1:]
+                    break
+    finally:
+        # stops the searches that are still queued
+        results.close()
+        if checkpoint is not None:
+            checkpoint.save()
+    return len(new_queries) - len(state.pending)
+
+def order_stopped_top(client, state, limit, tag_list, workers=SEARCH_WORKERS, stats=None, exclude=None, scope=SEARCH_SCOPE):
+    # The top `limit` files of a ranking that stopped early. The queries that weren't searched are matched against
+    # the metadata of the best files only, system predicates that can't be checked locally are searched. Files are
+    # checked best first until no file further down could still make it into the top, even with every positive
+    # query left matching it. Once that takes more metadata requests than there are queries left, those are searched.
+    # Without the full scope the searches are cut down to the base set, like search_tags_cached does.
+    base = FileIdSet(list(state.base_ids)) if scope != "full" else None
+    pending_positive = sum(score for key, query, score in state.pending if score > 0)
+    matcher = TagMatcher()
+    local = []
+    searched = {}  # position in pending -> file ids, for the queries that have to be searched
+    for position, (key, query, score) in enumerate(state.pending):
+        predicate = query[0]
+        if isinstance(predicate, str) and predicate.startswith("system:"):
+            check = parse_system_predicate(predicate)
+            if check is None:
+                searched[position] = None
+            else:
+                local.append((position, check))
+            continue
+        for term in (predicate if isinstance(predicate, list) else [predicate]):
+            matcher.add(term, position)
+
+    def search_pending(positions):
+        positions = [position for position in positions if searched.get(position) is None]
+        queries = [state.pending[position][1] for position in positions]
+        for index, file_ids in search_tags_concurrently(client, queries, workers, None, stats):
+            searched[positions[index]] = set(base.keep(file_ids) if base is not None else file_ids)
+
+    search_pending(list(searched))
+    final = {}  # file id -> score with every query
+    ranked = []
+    size = limit
+    while True:
+        ranked = state.scores.top(size, with_scores=True, exclude=exclude)
+        batch = [(file_id, score) for file_id, score in ranked if file_id not in final]
+        metadata_list = list(fetch_file_metadata(client, [file_id for file_id, score in batch], workers))
+        for file_id, score in batch:
+            final[file_id] = score
+        for metadata in metadata_list:
+            for position in matcher.match(get_display_tags(metadata)):
+                final[metadata["file_id"]] += state.pending[position][2]
+        for position, check in list(local):
+            try:
+                hits = [metadata["file_id"] for metadata in metadata_list if check(metadata)]
+            except KeyError:
+                # hydrus did not send this field, search it instead
+                local.remove((position, check))
+                searched[position] = None
+                search_pending([position])
+                continue
+            for file_id in hits:
+                final[file_id] += state.pending[position][2]
+        for position, file_ids in searched.items():
+            for file_id, score in batch:
+                if file_id in file_ids:
+                    final[file_id] += state.pending[position][2]
+        best = sorted(final.values(), reverse=True)
+        if len(ranked) < size or (len(best) >= limit and best[limit - 1] >= ranked[-1][1] + pending_positive):
+            break
+        if size * 2 // METADATA_BATCH_SIZE > len(state.pending):
+            # checking more files would take more requests than searching what's left, search it and rank normally
+            queries = [query for key, query, score in state.pending]
+            for index, file_ids in search_tags_concurrently(client, queries, workers, None, stats):
+                key, query, score = state.pending[index]
+                if base is not None:
+                    file_ids = base.keep(file_ids)
+                state.results[key] = array('q', file_ids)
+                state.query_scores[key] = score
+                state.searched_at[key] = time.time()
+                state.scores.add(file_ids, score)
+            state.pending = []
+            return state.scores.top(limit, exclude=exclude)
+        size *= 2
+    if stats is not None:
+        stats.skipped += sum(state.sizes.get(key, 1) for position, (key, query, score) in enumerate(state.pending) if position not in searched)
+    # sorted is stable, files with the same final score keep their order
+    return sorted(final, key=lambda file_id: -final[file_id])[:limit]
+
+# Metadata Scoring
+SYSTEM_NUMBER_PATTERN = re.compile(r"^system:(width|height|number of frames)\s*(=|<|>|\u2260|!=)\s*([\d,.]+)$")
+SYSTEM_RATIO_PATTERN = re.compile(r"^system:ratio\s*(=|wider than|taller than)\s*(\d+):(\d+)$")
+SYSTEM_FLAGS = {
+    "system:has audio": ("has_audio", True),
+    "system:no audio": ("has_audio", False),
+    "system:has transparency": ("has_transparency", True),
+    "system:no transparency": ("has_transparency", False),
+    "system:inbox": ("is_inbox", True),
+    "system:archive": ("is_inbox", False),
+}
+SYSTEM_NUMBER_FIELDS = {"width": "width", "height": "height", "number of frames": "num_frames"}
+
+def parse_system_predicate(predicate):
+    # Returns a function metadata -> bool, or None if the predicate can't be checked locally.
+    # The function raises KeyError when hydrus did not send the field it needs.
+    predicate = predicate.strip().lower()
+    if predicate in SYSTEM_FLAGS:
+        field, expected = SYSTEM_FLAGS[predicate]
+        return lambda metadata: bool(metadata[field]) == expected
+    match = SYSTEM_NUMBER_PATTERN.match(predicate)
+    if match:
+        field = SYSTEM_NUMBER_FIELDS[match.group(1)]
+        operator = match.group(2)
+        value = float(match.group(3).replace(",", ""))
+        def check_number(metadata):
+            number = metadata[field]
+            if number is None:
+                return False
+            if operator == "=":
+                return number == value
+            if operator == "<":
+                return number < value
+            if operator == ">":
+                return number > value
+            return number != value
+        return check_number
+    match = SYSTEM_RATIO_PATTERN.match(predicate)
+    if match:
+        operator = match.group(1)
+        ratio_width, ratio_height = int(match.group(2)), int(match.group(3))
+        def check_ratio(metadata):
+            width, height = metadata["width"], metadata["height"]
+            if not width or not height:
+                return False
+            if operator == "=":
+                return width * ratio_height == height * ratio_width
+            if operator == "wider than":
+                return width * ratio_height > height * ratio_width
+            return width * ratio_height < height * ratio_width
+        return check_ratio
+    return None
+
+def get_display_tags(metadata):
+    services = metadata.get("tags", {})
+    if ALL_KNOWN_TAGS_SERVICE_KEY in services:
+        services = {ALL_KNOWN_TAGS_SERVICE_KEY: services[ALL_KNOWN_TAGS_SERVICE_KEY]}
+    tags = set()
+    for service in services.values():
+        tags.update(service.get("display_tags", {}).get("0", []))
+    return tags
+
+class TagMatcher:
+    # Matches display tags against search terms like a hydrus tag search: namespaced terms exactly, unnamespaced
+    # ones in every namespace, terms with * as wildcards. Every term points at the entries (e.g. rows) it belongs to
+    def __init__(self):
+        self.exact_tags = {}
+        self.subtags = {}
+        self.wildcard_tags = []
+
+    def add(self, term, index):
+        if "*" in term:
+            self.wildcard_tags.append((term, index))
+        elif ":" in term:
+            self.exact_tags.setdefault(term, []).append(index)
+        else:
+            self.subtags.setdefault(term, []).append(index)
+
+    def match(self, tags):
+        # the entries matched by any of the tags, each once
+        matched = set()
+        for tag in tags:
+            if tag in self.exact_tags:
+                matched.update(self.exact_tags[tag])
+            subtag = tag.split(":", 1)[1] if ":" in tag else tag
+            if subtag in self.subtags:
+                matched.update(self.subtags[subtag])
+            for pattern, index in self.wildcard_tags:
+                if fnmatch.fnmatchcase(tag, pattern):
+                    matched.add(index)
+        return matched
+
+def fetch_file_metadata(client, file_ids, workers=SEARCH_WORKERS, pbar=None, batch_size=METADATA_BATCH_SIZE):
+    # Yields metadata dicts, batches are requested in parallel
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        futures = [executor.submit(client.get_file_metadata, file_ids=chunk) for chunk in yield_chunks(file_ids, batch_size)]
+        for future in as_completed(futures):
+            yield from future.result()
+            if pbar is not None:
+                pbar.update(1)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def score_files_from_metadata(client, rows, tag_list, workers=SEARCH_WORKERS, scores=None, pbar=None, stats=None):
+    # Fetches the blacklist + whitelist candidates once, then matches every TagScores row against their metadata.
+    # System predicates we can't evaluate locally are still searched in hydrus, restricted by tag_list.
+    candidate_ids, seconds = timed_search(client, tag_list)
+    if stats is not None:
+        stats.record_search("base", seconds, len(candidate_ids))
+    # every tag and sibling points at the rows it belongs to, a file counts each row once
+    matcher = TagMatcher()
+    system_rows = []
+    row_scores = []
+    for index, row in enumerate(rows):
+        tag, score = row[0], row[1]
+        if score is None:
+            score = DEFAULT_SCORE
+        row_scores.append(score)
+        if tag.startswith("system:"):
+            system_rows.append((index, tag, score, parse_system_predicate(tag)))
+            continue
+        for term in [tag] + parse_siblings(tag, row[2]):
+            matcher.add(term, index)
+    searched_rows = [(index, tag, score) for index, tag, score, check in system_rows if check is None]
+    local_rows = [(index, tag, score, check) for index, tag, score, check in system_rows if check is not None]
+
+    batches = (len(candidate_ids) + METADATA_BATCH_SIZE - 1) // METADATA_BATCH_SIZE
+    if pbar is None:
+        from tqdm import tqdm
+        pbar = tqdm(total=batches + len(searched_rows), desc="Scoring File Metadata", miniters=10, ncols=80)
+    else:
+        pbar.total = batches + len(searched_rows)
+        pbar.refresh()
+    if scores is None:
+        scores = ScoreAccumulator()
+    matched_ids = []
+    matched_scores = []
+    # files each local system row matched, only counted once every file was checked: a row hydrus doesn't send
+    # the field of for some file is searched instead, and the files it matched before must not count it twice
+    local_hits = [[] for row in local_rows]
+    for metadata in fetch_file_metadata(client, candidate_ids, workers, pbar):
+        file_id = metadata["file_id"]
+        matched_rows = matcher.match(get_display_tags(metadata))
+        if matched_rows:
+            matched_ids.append(file_id)
+            matched_scores.append(sum(row_scores[index] for index in sorted(matched_rows)))
+        for position, (index, tag, tag_score, check) in enumerate(local_rows):
+            if check is None:
+                continue
+            try:
+                hit = check(metadata)
+            except KeyError:
+                # hydrus did not send this field, fall back to searching for it
+                searched_rows.append((index, tag, tag_score))
+                local_rows[position] = (index, tag, tag_score, None)
+                local_hits[position] = []
+                pbar.total += 1
+                continue
+            if hit:
+                local_hits[position].append(file_id)
+    scores.add(matched_ids, matched_scores)
+    for (index, tag, tag_score, check), file_ids in zip(local_rows, local_hits):
+        if file_ids:
+            scores.add(file_ids, tag_score)
+
+    # anything matched by a fallback search can only be in the candidate set, because tag_list is part of the query
+    searched_rows.sort()
+    queries = [[tag] + tag_list for index, tag, score in searched_rows]
+    if stats is not None:
+        stats.tag_searches += len(queries)
+    for position, file_ids in search_tags_concurrently(client, queries, workers, pbar, stats):
+        scores.add(file_ids, searched_rows[position][2])
+    return scores
+
+# Page Delivery
+class PageDelivery:
+    # Sends ranked file ids to a hydrus page in chunks and in order, retrying failed chunks.
+    # Remembers what was sent, so early and final sends of the same ranking never repeat a file.
+    def __init__(self, client, page_key, chunk_size=DELIVERY_CHUNK_SIZE, retries=DELIVERY_RETRIES):
+        self.client = client
+        self.page_key = page_key
+        self.chunk_size = max(1, chunk_size)
+        self.retries = retries
+        self.sent = set()
+        self.sent_order = []
+        self.seconds = 0.0  # spent in add_files_to_page, retries included
+
+    def send(self, file_ids):
+        started = time.perf_counter()
+        try:
+            self.send_new(file_ids)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+    def send_new(self, file_ids):
+        new_ids = [file_id for file_id in file_ids if file_id not in self.sent]
+        for chunk in yield_chunks(new_ids, self.chunk_size):
+            for attempt in range(self.retries + 1):
+                try:
+                    self.client.add_files_to_page(self.page_key, chunk)
+                    break
+                except Exception:
+                    if attempt == self.retries:
+                        raise
+                    time.sleep(0.5 * 2 ** attempt)
+            self.sent.update(chunk)
+            self.sent_order.extend(chunk)
+
+# Hydrus Client
+def create_client(access_key, api_url, workers=SEARCH_WORKERS):
+    # One client per session, its connections are kept alive and pooled, enough of them for every search worker
+    import hydrus_api
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(10, workers))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return hydrus_api.Client(access_key=access_key, api_url=api_url, session=session)
+
+def find_page_key(tabs, tabname):
+    if 'pages' in tabs and isinstance(tabs['pages'], list):
+        for page in tabs['pages']:
+            if page.get('name') == tabname:
+                return page.get('page_key')
+            if 'pages' in page and isinstance(page['pages'], list):
+                sub_page_key = find_page_key(page, tabname)
+                if sub_page_key:
+                    return sub_page_key
+    return None
+
+def resolve_page_key(client, tabname, cache_key=None):
+    # The page key found last time is checked with one get_page_info call,
+    # the whole page tree is only walked again if that tab is gone or was renamed.
+    # cache_key tells tabs of the same name in different clients apart
+    import hydrus_api
+    cache_key = cache_key or tabname
+    with db_lock:
+        row = get_db().execute('SELECT page_key FROM PageKeys WHERE tabname = ?', (cache_key,)).fetchone()
+    if row:
+        try:
+            page_info = client.get_page_info(row[0])
+            page_info = page_info.get('page_info', page_info)  # hydrus_api 4 returns the inner dict, older versions the whole response
+            if page_info.get('name') == tabname:
+                return row[0]
+        except hydrus_api.APIError:
+            pass  # hydrus restarted or the tab was closed, look it up again
+    page_key = find_page_key(client.get_pages(), tabname)
+    with db_lock:
+        mydb = get_db()
+        if page_key:
+            mydb.execute('REPLACE INTO PageKeys (tabname, page_key) VALUES (?, ?)', (cache_key, page_key))
+        else:
+            mydb.execute('DELETE FROM PageKeys WHERE tabname = ?', (cache_key,))
+        mydb.commit()
+    return page_key
+
+# Background Run
+class ArchiverCancelled(Exception):
+    pass
+
+class RunProgress:
+    # Used instead of tqdm when the archiver runs in the background: reports progress to the window
+    # through a queue and stops the run at the next finished search once cancel_event is set
+    def __init__(self, messages, cancel_event, total=0):
+        self.messages = messages
+        self.cancel_event = cancel_event
+        self.total = total
+        self.n = 0
+        self.started = time.time()
+
+    def update(self, n=1):
+        self.n += n
+        self.refresh()
+        if self.cancel_event.is_set():
+            raise ArchiverCancelled()
+
+    def refresh(self):
+        self.messages.put(("progress", self.n, self.total, time.time() - self.started))
+
+    def close(self):
+        pass
+
+class SharedProgress:
+    # One client's part of a progress bar (RunProgress or tqdm) several clients update at the same time,
+    # its total is added to the shared one
+    def __init__(self, pbar, lock):
+        self.pbar = pbar
+        self.lock = lock
+        self.own_total = 0
+
+    @property
+    def total(self):
+        return self.own_total
+
+    @total.setter
+    def total(self, value):
+        with self.lock:
+            self.pbar.total += value - self.own_total
+            self.own_total = value
+
+    def update(self, n=1):
+        with self.lock:
+            self.pbar.update(n)
+
+    def refresh(self):
+        with self.lock:
+            self.pbar.refresh()
+
+    def close(self):
+        pass
+
+def report_with_messagebox(kind, title, message):
+    if kind == "error":
+        messagebox.showerror(title, message)
+    else:
+        messagebox.showinfo(title, message)
+
+# DB High Score Archiver
+def db_high_score_archiver(client, blacklist, whitelist, limit, tabname, workers=SEARCH_WORKERS, cache_ttl=SEARCH_CACHE_TTL, mode=SCORING_MODE, ranking=None, pbar=None, report=report_with_messagebox, chunk_size=DELIVERY_CHUNK_SIZE, early_delivery=EARLY_DELIVERY, planner=SEARCH_PLANNER, profile=DEFAULT_PROFILE, seen_mode=SEEN_FILES, early_stop=EARLY_STOP, scope=SEARCH_SCOPE, outputs=(), checkpoint_every=CHECKPOINT_EVERY):
+    # outputs ([(tabname, limit, predicates)]) are more tabs filled from the same scores, each with the top files
+    # that also match its predicates. They cost one search each, not a search per tag.
+    # checkpoint_every is how many seconds apart the finished searches are saved, 0 turns checkpoints off.
+    def display_error(title, message):
+        report("error", title, message)
+
+    stats = RunStats()
+    started = time.perf_counter()
+    tag_list = ["-" + tag for tag in blacklist] + whitelist
+    delivery = None
+    output_deliveries = []
+
+    def finish(status):
+        # Timings of this run go to RunHistory whether it finished or not
+        stats.add_time("total", time.perf_counter() - started)
+        if delivery is not None:
+            stats.add_time("delivery", delivery.seconds + sum(output_delivery.seconds for output_delivery in output_deliveries))
+            stats.delivered = len(delivery.sent) + sum(len(output_delivery.sent) for output_delivery in output_deliveries)
+        try:
+            save_run_history(stats, mode, tag_list, status)
+        except sqlite3.Error:
+            pass
+
+    try:
+        # Look the tab up first, so a missing tab fails before any searching and early results have a target
+        page_key = resolve_page_key(client, tabname)
         if not page_key:
             display_error("Error", f"Tab '{tabname}' not found.")
             return
+        delivery = PageDelivery(client, page_key, chunk_size)
+        for output_tab, output_limit, predicates in outputs:
+            output_key = resolve_page_key(client, output_tab)
+            if not output_key:
+                display_error("Error", f"Tab '{output_tab}' not found.")
+                return
+            output_deliveries.append(PageDelivery(client, output_key, chunk_size))
+
+        rows = load_database_contents(profile)
+        seen = load_seen_files(profile) if seen_mode != "off" else FileIdSet()
+        if ranking is None:
+            ranking = RankingState()
+        checkpoint = None
+        if mode != "metadata" and checkpoint_every > 0:
+            checkpoint = RunCheckpoint(profile, tag_list, planner, scope, checkpoint_every, cache_ttl)
+            if ranking.base_ids is None:
+                # nothing in memory, a run that was interrupted may have left its searches
+                stats.resumed = checkpoint.restore(ranking, tag_list)
+        if pbar is None:
+            from tqdm import tqdm
+            pbar = tqdm(total=len(rows), desc="Processing DB Tags", miniters=10, ncols=80)
+        search_started = time.perf_counter()
+        if mode == "metadata":
+            ranking.reset()
+            scores = score_files_from_metadata(client, rows, tag_list, workers, pbar=pbar, stats=stats)
+        else:
+            # a file certain to be in the top of all files is also certain to be in the top of the unseen ones.
+            # The page gets them in the provisional order, hydrus can't reorder a page, only the final send is by rank
+            on_stable = (lambda file_ids: delivery.send(seen.filter(file_ids))) if early_delivery else None
+            # demoting needs the order of the seen files too, only a top without them can stop early.
+            # The outputs rank other files than the top of all files, they need every search
+            stop_early = early_stop and seen_mode != "demote" and not outputs
+            exclude = seen if seen_mode == "exclude" else None
+            update_ranking(client, ranking, rows, tag_list, workers, pbar, cache_ttl, limit, on_stable, stats, planner, stop_early=stop_early, exclude=exclude, scope=scope, checkpoint=checkpoint)
+            scores = ranking.scores
+        # early sends happened while searching, they are counted as delivery only
+        stats.add_time("search", time.perf_counter() - search_started - delivery.seconds)
+        stats.files_scored = len(scores)
+        pbar.close()
 
-        client.add_files_to_page(page_key, top_file_ids)
-        messagebox.showinfo("Success", f"Files added to tab '{tabname}'.")
+        sort_started = time.perf_counter()
+        if mode != "metadata" and ranking.pending:
+            top_files = order_stopped_top(client, ranking, limit, tag_list, workers, stats, exclude, scope)
+        else:
+            top_files = rank_with_seen(scores, limit, seen, seen_mode)
+        stats.add_time("sort", time.perf_counter() - sort_started)
+        delivery.send(top_files)
+        fingerprint = ranking_fingerprint(rows, tag_list)
+        if seen_mode != "off":
+            record_seen_files(profile, fingerprint, delivery.sent_order)
+        for (output_tab, output_limit, predicates), output_delivery in zip(outputs, output_deliveries):
+            # the blacklist + whitelist with the output's predicates, its files are ranked from the shared scores.
+            # Every output remembers its own sent files, a file in the profile's tab can still go to it
+            query = tag_list + predicates
+            output_ids, seconds = timed_search(client, query)
+            stats.record_search(query, seconds, len(output_ids))
+            output_seen = load_seen_files(profile, f"tab {output_tab}") if seen_mode != "off" else FileIdSet()
+            sort_started = time.perf_counter()
+            output_files = rank_with_seen(scores, output_limit, output_seen, seen_mode, FileIdSet(output_ids))
+            stats.add_time("sort", time.perf_counter() - sort_started)
+            output_delivery.send(output_files)
+            if seen_mode != "off":
+                record_seen_files(profile, fingerprint, output_delivery.sent_order, f"tab {output_tab}")
+        summary = " " + stats.summary() if mode != "metadata" else ""
+        if checkpoint is not None:
+            checkpoint.clear()
+        finish("success")
+        tabs = ", ".join(f"'{name}'" for name in [tabname] + [output_tab for output_tab, output_limit, predicates in outputs])
+        report("info", "Success", f"Files added to {'tabs' if outputs else 'tab'} {tabs}.{summary} {stats.timing()}")
+    except ArchiverCancelled:
+        finish("cancelled")
+        report("cancelled", "Cancelled", "The run was cancelled.")
     except Exception as e:
+        finish("error")
         display_error("Error", str(e))
 
+def multi_profile_archiver(client, blacklist, whitelist, limit, profiles, workers=SEARCH_WORKERS, cache_ttl=SEARCH_CACHE_TTL, rankings=None, pbar=None, report=report_with_messagebox, chunk_size=DELIVERY_CHUNK_SIZE, planner=SEARCH_PLANNER, seen_mode=SEEN_FILES, scope=SEARCH_SCOPE, skipped=()):
+    # Runs several profiles ([(profile, tabname)]) in one pass: the union of their tags is searched once, every
+    # profile is scored from the shared results and its top `limit` files go to its own tab. Always search mode.
+    # skipped names the settings that were set but this kind of run doesn't use, they go into the report.
+    stats = RunStats()
+    started = time.perf_counter()
+    tag_list = ["-" + tag for tag in blacklist] + whitelist
+    deliveries = {}
+
+    def finish(status):
+        stats.add_time("total", time.perf_counter() - started)
+        stats.add_time("delivery", sum(delivery.seconds for delivery in deliveries.values()))
+        stats.delivered = sum(len(delivery.sent) for delivery in deliveries.values())
+        try:
+            save_run_history(stats, "profiles", tag_list, status)
+        except sqlite3.Error:
+            pass
+
+    try:
+        for profile, tabname in profiles:
+            page_key = resolve_page_key(client, tabname)
+            if not page_key:
+                report("error", "Error", f"Tab '{tabname}' of profile '{profile}' not found.")
+                return
+            deliveries[profile] = PageDelivery(client, page_key, chunk_size)
+
+        rows_by_profile = {profile: load_database_contents(profile) for profile, tabname in profiles}
+        if rankings is None:
+            rankings = {}
+        states = {profile: rankings.setdefault(profile, RankingState()) for profile, tabname in profiles}
+        if pbar is None:
+            from tqdm import tqdm
+            pbar = tqdm(total=0, desc="Processing DB Tags", miniters=10, ncols=80)
+        search_started = time.perf_counter()
+        update_rankings(client, states, rows_by_profile, tag_list, workers, pbar, cache_ttl, stats, planner, scope=scope)
+        stats.add_time("search", time.perf_counter() - search_started)
+        stats.files_scored = sum(len(state.scores) for state in states.values())
+        pbar.close()
+
+        for profile, tabname in profiles:
+            seen = load_seen_files(profile) if seen_mode != "off" else FileIdSet()
+            sort_started = time.perf_counter()
+            top_files = rank_with_seen(states[profile].scores, limit, seen, seen_mode)
+            stats.add_time("sort", time.perf_counter() - sort_started)
+            deliveries[profile].send(top_files)
+            if seen_mode != "off":
+                record_seen_files(profile, ranking_fingerprint(rows_by_profile[profile], tag_list), deliveries[profile].sent_order)
+        finish("success")
+        tabs = ", ".join(f"'{tabname}'" for profile, tabname in profiles)
+        message = f"Files added to tabs {tabs}. {stats.summary()} {stats.timing()}"
+        if skipped:
+            message += f" Not used when profiles run together: {', '.join(skipped)}."
+        report("info", "Success", message)
+    except ArchiverCancelled:
+        finish("cancelled")
+        report("cancelled", "Cancelled", "The run was cancelled.")
+    except Exception as e:
+        finish("error")
+        report("error", "Error", str(e))
+
+def multi_client_archiver(clients, blacklist, whitelist, limit, workers=SEARCH_WORKERS, rankings=None, pbar=None, report=report_with_messagebox, chunk_size=DELIVERY_CHUNK_SIZE, planner=SEARCH_PLANNER, profile=DEFAULT_PROFILE, ranking_mode=CLIENT_RANKING, scope=SEARCH_SCOPE, cache_ttl=SEARCH_CACHE_TTL, seen_mode=SEEN_FILES, skipped=()):
+    # Searches the profile's tags in several hydrus clients ([(name, client, tabname)]) at the same time, each with
+    # its own search workers. "separate": every client gets the top `limit` of its own files. "merged": one top
+    # `limit` over all clients, a file (by hash) in more than one of them counts with its best score, every client
+    # gets the files of it that were in its own top. The search cache is not used, it does not know clients apart,
+    # cache_ttl only limits how long the results kept in rankings are reused. Files already sent are remembered per
+    # client ("main" is the profile's usual target). skipped names the settings that were set but this kind of run
+    # doesn't use, they go into the report.
+    stats = RunStats()
+    started = time.perf_counter()
+    tag_list = ["-" + tag for tag in blacklist] + whitelist
+    deliveries = {}
+    errors = []
+
+    def finish(status):
+        stats.add_time("total", time.perf_counter() - started)
+        stats.add_time("delivery", sum(delivery.seconds for delivery in deliveries.values()))
+        stats.delivered = sum(len(delivery.sent) for delivery in deliveries.values())
+        try:
+            save_run_history(stats, "clients", tag_list, status)
+        except sqlite3.Error:
+            pass
+
+    def rank_client(name, client, tabname, client_pbar):
+        client_stats = RunStats()
+        page_key = resolve_page_key(client, tabname, f"{name}: {tabname}")
+        if not page_key:
+            raise ValueError(f"Tab '{tabname}' not found.")
+        update_ranking(client, rankings.setdefault(name, RankingState()), rows, tag_list, workers, client_pbar, 0, limit, None, client_stats, planner, scope=scope, ranking_ttl=cache_ttl)
+        scores = rankings[name].scores
+        seen = load_seen_files(profile, seen_target(name)) if seen_mode != "off" else FileIdSet()
+        # unseen files first, with "demote" the best seen ones are kept too and only used to fill up
+        ranked = scores.top(limit, with_scores=True, exclude=seen)
+        ranked_seen = []
+        if seen_mode == "demote" and len(seen):
+            ranked_seen = [(file_id, score) for file_id, score in scores.top(limit, with_scores=True) if file_id in seen]
+        hashes = {}
+        if ranking_mode == "merged":
+            for metadata in fetch_file_metadata(client, [file_id for file_id, score in ranked + ranked_seen], workers):
+                hashes[metadata["file_id"]] = metadata["hash"]
+        client_stats.files_scored = len(scores)
+        return page_key, ranked, ranked_seen, hashes, client_stats
+
+    def seen_target(name):
+        return '' if name == "main" else f"client {name}"
+
+    def merge_top(lists, count):
+        # hash -> place in the top `count` of all clients, a file in more than one of them counts with its best score
+        best = {}
+        for ranked, hashes in lists:
+            for file_id, score in ranked:
+                file_hash = hashes.get(file_id)
+                if file_hash is not None and score > best.get(file_hash, float('-inf')):
+                    best[file_hash] = score
+        return heapq.nlargest(count, best, key=best.get)
+
+    try:
+        rows = load_database_contents(profile)
+        if rankings is None:
+            rankings = {}
+        if pbar is None:
+            from tqdm import tqdm
+            pbar = tqdm(total=0, desc="Processing DB Tags", miniters=10, ncols=80)
+        progress_lock = threading.Lock()
+        search_started = time.perf_counter()
+        ranked_by_client = {}
+        executor = ThreadPoolExecutor(max_workers=len(clients))
+        try:
+            futures = {executor.submit(rank_client, name, client, tabname, SharedProgress(pbar, progress_lock)): (name, client) for name, client, tabname in clients}
+            for future in as_completed(futures):
+                name, client = futures[future]
+                try:
+                    page_key, ranked, ranked_seen, hashes, client_stats = future.result()
+                except ArchiverCancelled:
+                    raise
+                except Exception as e:
+                    # one client being down doesn't stop the others
+                    errors.append(f"{name}: {e}")
+                    continue
+                stats.merge(client_stats, name)
+                deliveries[name] = PageDelivery(client, page_key, chunk_size)
+                ranked_by_client[name] = (ranked, ranked_seen, hashes)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        stats.add_time("search", time.perf_counter() - search_started)
+        pbar.close()
+
+        sort_started = time.perf_counter()
+        if ranking_mode == "merged":
+            order = merge_top([(ranked, hashes) for ranked, ranked_seen, hashes in ranked_by_client.values()], limit)
+            if len(order) < limit:
+                # demoted: seen files of any client fill up what the unseen ones left
+                taken = set(order)
+                order += [file_hash for file_hash in merge_top([(ranked_seen, hashes) for ranked, ranked_seen, hashes in ranked_by_client.values()], limit) if file_hash not in taken][:limit - len(order)]
+            position = {file_hash: index for index, file_hash in enumerate(order)}
+            top_by_client = {}
+            for name, (ranked, ranked_seen, hashes) in ranked_by_client.items():
+                own = [file_id for file_id, score in ranked + ranked_seen if hashes.get(file_id) in position]
+                top_by_client[name] = sorted(own, key=lambda file_id: position[hashes[file_id]])
+        else:
+            top_by_client = {name: [file_id for file_id, score in (ranked + ranked_seen)[:limit]] for name, (ranked, ranked_seen, hashes) in ranked_by_client.items()}
+        stats.add_time("sort", time.perf_counter() - sort_started)
+        for name, top_files in top_by_client.items():
+            try:
+                deliveries[name].send(top_files)
+            except Exception as e:
+                errors.append(f"{name}: {e}")
+            if seen_mode != "off":
+                record_seen_files(profile, ranking_fingerprint(rows, tag_list), deliveries[name].sent_order, seen_target(name))
+        finish("error" if errors and not top_by_client else "success")
+        sent = ", ".join(f"{name} {len(deliveries[name].sent)}" for name, client, tabname in clients if name in deliveries)
+        message = f"Files sent to {len(deliveries)} of {len(clients)} clients ({sent}). {stats.summary()} {stats.timing()}"
+        if skipped:
+            message += f" Not used with more clients: {', '.join(skipped)}."
+        if errors:
+            report("error", "Some Clients Failed", message + "\n" + "\n".join(errors))
+        else:
+            report("info", "Success", message)
+    except ArchiverCancelled:
+        finish("cancelled")
+        report("cancelled", "Cancelled", "The run was cancelled.")
+    except Exception as e:
+        finish("error")
+        report("error", "Error", str(e))
+
+# Tag Table Model
+class TagTableModel:
+    # Every TagScores row in memory, the Data tab only draws the rows that are on screen.
+    # `view` holds the tags that pass the filter in display order. The filter matches substrings of tag and comment,
+    # a trigram index narrows the candidates down first so typing into the filter stays instant on big tables.
+    COLUMNS = ("Tag", "Score", "Siblings", "Comment")
+
+    def __init__(self, rows=()):
+        self.load(rows)
+
+    def load(self, rows):
+        self.rows = {}  # tag -> [tag, score, siblings, comment]
+        self.trigrams = {}  # three characters of a lowercased tag or comment -> tags containing them
+        self.order = []  # every tag in display order
+        self.sort_orders = {}  # column -> every tag sorted ascending by it, dropped when that column changes
+        self.sorted_by = None  # (column, reverse) of the current order
+        self.filter_text = ""
+        for tag, score, siblings, comment in rows:
+            self.rows[tag] = [tag, score, siblings, comment]
+            self.order.append(tag)
+            self.index_row(tag)
+        self.view = list(self.order)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, tag):
+        return tag in self.rows
+
+    def get(self, tag):
+        return self.rows.get(tag)
+
+    def search_text(self, tag):
+        comment = self.rows[tag][3]
+        return f"{tag}\n{comment}".lower() if comment else tag.lower()
+
+    def index_row(self, tag):
+        text = self.search_text(tag)
+        for i in range(len(text) - 2):
+            self.trigrams.setdefault(text[i:i + 3], set()).add(tag)
+
+    def unindex_row(self, tag):
+        text = self.search_text(tag)
+        for i in range(len(text) - 2):
+            tags = self.trigrams.get(text[i:i + 3])
+            if tags is not None:
+                tags.discard(tag)
+                if not tags:
+                    del self.trigrams[text[i:i + 3]]
+
+    def set_filter(self, text):
+        self.filter_text = text.strip().lower()
+        self.refresh_view()
+
+    def refresh_view(self):
+        text = self.filter_text
+        if not text:
+            self.view = list(self.order)
+            return
+        candidates = None
+        for i in range(len(text) - 2):
+            tags = self.trigrams.get(text[i:i + 3], set())
+            candidates = tags if candidates is None or len(tags) < len(candidates) else candidates
+            if not candidates:
+                break
+        if candidates is None:
+            # shorter than a trigram, check every row
+            self.view = [tag for tag in self.order if text in self.search_text(tag)]
+        elif len(candidates) < len(self.order) // 8:
+            # few candidates: check them and put them back in display order
+            matched = {tag for tag in candidates if text in self.search_text(tag)}
+            self.view = [tag for tag in self.order if tag in matched]
+        else:
+            self.view = [tag for tag in self.order if tag in candidates and text in self.search_text(tag)]
+
+    def upsert(self, tag, score, siblings, comment, old_tag=None):
+        # Adds a row or changes one, a renamed row keeps its place
+        self.sort_orders.clear()
+        if old_tag is not None and old_tag != tag and old_tag in self.rows:
+            self.unindex_row(old_tag)
+            del self.rows[old_tag]
+            self.order[self.order.index(old_tag)] = tag
+        elif tag in self.rows:
+            self.unindex_row(tag)
+        else:
+            self.order.append(tag)
+        self.rows[tag] = [tag, score, siblings, comment]
+        self.index_row(tag)
+        self.refresh_view()
+
+    def set_score(self, tag, score):
+        # score isn't part of the filter index, the row stays where it is until the next sort
+        self.rows[tag][1] = score
+        self.sort_orders.pop("Score", None)
+
+    def set_siblings(self, tag, siblings):
+        self.rows[tag][2] = siblings
+        self.sort_orders.pop("Siblings", None)
+
+    def remove(self, tag):
+        self.unindex_row(tag)
+        del self.rows[tag]
+        self.order.remove(tag)
+        if tag in self.view:
+            self.view.remove(tag)
+        for order in self.sort_orders.values():
+            order.remove(tag)
+
+    def sort(self, col, reverse=False):
+        # Sorting a column again, or the other way round, reuses its cached order. Scores are compared as floats,
+        # the text columns case insensitive with empty cells first
+        order = self.sort_orders.get(col)
+        if order is None:
+            index = self.COLUMNS.index(col)
+            if col == "Score":
+                key = lambda tag: DEFAULT_SCORE if self.rows[tag][1] is None else self.rows[tag][1]
+            else:
+                key = lambda tag: (self.rows[tag][index] or "").lower()
+            order = sorted(self.rows, key=key)
+            self.sort_orders[col] = order
+        self.order = order[::-1] if reverse else list(order)
+        self.sorted_by = (col, reverse)
+        self.refresh_view()
+
 # Main Application
 class HydrusFileHighScoreApp(tk.Tk):
-    def __init__(self):
+    def __init__(self, exit_after_startup=False):
         super().__init__()
         self.settings = load_settings_from_db()
         self.title("Hydrus File High Score Archiver")
@@ -224,6 +2234,16 @@ class HydrusFileHighScoreApp(tk.Tk):
         self.style.configure('Treeview', background="#2b2b2b", foreground="#ffffff", fieldbackground="#2b2b2b", font=('Helvetica', int(self.settings.get("FONT_SIZE", 10))))
         self.style.configure('Treeview.Heading', background="#2b2b2b", foreground="#ffffff", font=('Helvetica', int(self.settings.get("FONT_SIZE", 10))))
 
+        # Status bar with progress of the running archiver
+        self.status_frame = ttk.Frame(self)
+        self.status_frame.pack(side='bottom', fill='x')
+        self.progress_bar = ttk.Progressbar(self.status_frame, mode='determinate', length=200)
+        self.progress_bar.pack(side='left', padx=5, pady=5)
+        self.status_label = ttk.Label(self.status_frame, text="Ready", font=('Helvetica', int(self.settings.get("FONT_SIZE", 10))))
+        self.status_label.pack(side='left', padx=5, pady=5)
+        self.cancel_button = ttk.Button(self.status_frame, text="Cancel", command=self.cancel_archiver, style='TButtonRed.TButton', state='disabled')
+        self.cancel_button.pack(side='right', padx=5, pady=5)
+
         # Notebook for tabs
         self.notebook = ttk.Notebook(self)
         self.notebook.pack(expand=1, fill='both')
@@ -232,8 +2252,43 @@ class HydrusFileHighScoreApp(tk.Tk):
         self.data_tab = ttk.Frame(self.notebook)
         self.notebook.add(self.data_tab, text="Data")
 
-        # Treeview in Data Tab
-        self.tree = ttk.Treeview(self.data_tab, columns=("Tag", "Score", "Siblings", "Comment"), show='headings')
+        # Profile bar in Data Tab, every profile is its own TagScores table with its own hydrus tab
+        self.profile = self.settings.get("PROFILE", DEFAULT_PROFILE)
+        self.profile_frame = ttk.Frame(self.data_tab)
+        self.profile_frame.pack(fill='x')
+        self.profile_label = ttk.Label(self.profile_frame, text="Profile:", font=('Helvetica', int(self.settings.get("FONT_SIZE", 10))))
+        self.profile_label.pack(side='left', padx=5, pady=5)
+        self.profile_combo = ttk.Combobox(self.profile_frame, state='readonly')
+        self.profile_combo.pack(side='left', padx=5, pady=5)
+        self.profile_combo.bind('<<ComboboxSelected>>', lambda event: self.switch_profile(self.profile_combo.get()))
+        self.profile_run_var = tk.BooleanVar()
+        self.profile_run_check = ttk.Checkbutton(self.profile_frame, text="Run on Execute", variable=self.profile_run_var, command=self.toggle_profile_run)
+        self.profile_run_check.pack(side='left', padx=5, pady=5)
+        self.delete_profile_button = ttk.Button(self.profile_frame, text="Delete Profile", command=self.delete_current_profile, style='TButtonRed.TButton')
+        self.delete_profile_button.pack(side='right', padx=5, pady=5)
+        self.new_profile_button = ttk.Button(self.profile_frame, text="New Profile", command=self.new_profile, style='TButtonGreen.TButton')
+        self.new_profile_button.pack(side='right', padx=5, pady=5)
+
+        # Filter box in Data Tab, matches parts of tags and comments
+        self.filter_frame = ttk.Frame(self.data_tab)
+        self.filter_frame.pack(fill='x')
+        self.filter_label = ttk.Label(self.filter_frame, text="Filter:", font=('Helvetica', int(self.settings.get("FONT_SIZE", 10))))
+        self.filter_label.pack(side='left', padx=5, pady=5)
+        self.filter_var = tk.StringVar()
+        self.filter_var.trace_add('write', self.apply_filter)
+        self.filter_entry = ttk.Entry(self.filter_frame, textvariable=self.filter_var, style='Dark.TEntry')
+        self.filter_entry.pack(side='left', expand=1, fill='x', padx=5, pady=5)
+        self.bind('<Control-f>', lambda event: self.filter_entry.focus_set())
+
+        # Treeview in Data Tab, it only holds the rows on screen, all rows live in self.model
+        self.model = TagTableModel()
+        self.view_offset = 0  # index in self.model.view of the top row on screen
+        self.selected_tag = None
+        self.row_height = font.Font(family='Helvetica', size=int(self.settings.get("FONT_SIZE", 10))).metrics('linespace') + 6
+        self.style.configure('Treeview', rowheight=self.row_height)
+        self.table_frame = ttk.Frame(self.data_tab)
+        self.table_frame.pack(expand=1, fill='both')
+        self.tree = ttk.Treeview(self.table_frame, columns=TagTableModel.COLUMNS, show='headings', selectmode='browse')
         self.tree.heading("Tag", text="Tag", command=lambda: self.sort_column("Tag"))
         self.tree.heading("Score", text="Score", command=lambda: self.sort_column("Score"))
         self.tree.heading("Siblings", text="Siblings", command=lambda: self.sort_column("Siblings"))
@@ -241,7 +2296,20 @@ class HydrusFileHighScoreApp(tk.Tk):
         column_widths = json.loads(self.settings.get("COLUMN_WIDTHS", json.dumps({"Tag": 150, "Score": 100, "Siblings": 150, "Comment": 200})))
         for col in column_widths:
             self.tree.column(col, width=int(column_widths[col]))
-        self.tree.pack(expand=1, fill='both')
+        self.tree_scrollbar = ttk.Scrollbar(self.table_frame, orient='vertical', command=self.scroll_rows)
+        self.tree_scrollbar.pack(side='right', fill='y')
+        self.tree.pack(side='left', expand=1, fill='both')
+        self.tree.bind('<Configure>', lambda event: self.render_rows())
+        self.tree.bind('<<TreeviewSelect>>', self.on_tree_select)
+        self.tree.bind('<MouseWheel>', lambda event: self.scroll_rows('scroll', -3 if event.delta > 0 else 3, 'units'))
+        self.tree.bind('<Button-4>', lambda event: self.scroll_rows('scroll', -3, 'units'))
+        self.tree.bind('<Button-5>', lambda event: self.scroll_rows('scroll', 3, 'units'))
+        self.tree.bind('<Up>', lambda event: self.move_selection(-1))
+        self.tree.bind('<Down>', lambda event: self.move_selection(1))
+        self.tree.bind('<Prior>', lambda event: self.move_selection(-self.visible_row_count()))
+        self.tree.bind('<Next>', lambda event: self.move_selection(self.visible_row_count()))
+        self.tree.bind('<Home>', lambda event: self.move_selection(-len(self.model.view)))
+        self.tree.bind('<End>', lambda event: self.move_selection(len(self.model.view)))
 
         # Bind keyboard shortcuts
         self.tree.bind('<KeyPress-+>', self.increase_score)
@@ -257,9 +2325,18 @@ class HydrusFileHighScoreApp(tk.Tk):
         self.delete_button = ttk.Button(self.data_tab, text="Delete", command=self.delete_tag, style='TButtonRed.TButton')
         self.delete_button.pack(side='left', padx=5, pady=5)
 
+        self.import_button = ttk.Button(self.data_tab, text="Import", command=self.import_tags, style='TButtonBlue.TButton')
+        self.import_button.pack(side='left', padx=5, pady=5)
+
+        self.export_button = ttk.Button(self.data_tab, text="Export", command=self.export_tags, style='TButtonBlue.TButton')
+        self.export_button.pack(side='left', padx=5, pady=5)
+
         self.execute_button = ttk.Button(self.data_tab, text="Execute", command=self.run_archiver, style='TButtonBlue.TButton')
         self.execute_button.pack(side='right', padx=5, pady=5)
 
+        self.siblings_button = ttk.Button(self.data_tab, text="Fill Siblings", command=self.fill_siblings, style='TButtonBlue.TButton')
+        self.siblings_button.pack(side='right', padx=5, pady=5)
+
         # Settings Tab
         self.settings_tab = ttk.Frame(self.notebook)
         self.notebook.add(self.settings_tab, text="Settings")
@@ -301,20 +2378,326 @@ class HydrusFileHighScoreApp(tk.Tk):
         self.score_increment_entry.insert(0, str(float(self.settings.get("SCORE_INCREMENT", DEFAULT_SCORE_INCREMENT))))
         self.score_increment_entry.grid(row=5, column=1, padx=10, pady=5)
 
-        # Load initial data
-        self.load_data()
-        self.sort_column("Score", reverse=True)
+        self.search_workers_label = ttk.Label(self.settings_tab, text="Search Workers:", font=('Helvetica', int(self.settings.get("FONT_SIZE", 10))))
+        self.search_workers_label.grid(row=6, column=0, padx=10, pady=5, sticky='w')
+        self.search_workers_entry = ttk.Entry(self.settings_tab, style='Dark.TEntry')
+        self.search_workers_entry.insert(0, str(int(self.settings.get("SEARCH_WORKERS", SEARCH_WORKERS))))
+        self.search_workers_entry.grid(row=6, column=1, padx=10, pady=5)
+
+        self.search_cache_ttl_label = ttk.Label(self.settings_tab, text="Search Cache TTL (s):", font=('Helvetica', int(self.settings.get("FONT_SIZE", 10))))
+        self.search_cache_ttl_label.grid(row=7, column=0, padx=10, pady=5, sticky='w')
+        self.search_cache_ttl_entry = ttk.Entry(self.settings_tab, style='Dark.TEntry')
+        self.search_cache_ttl_entry.insert(0, str(int(self.settings.get("SEARCH_CACHE_TTL", SEARCH_CACHE_TTL))))
+        self.search_cache_ttl_entry.grid(row=7, column=1, padx=10, pady=5)
+
+        self.clear_cache_button = ttk.Button(self.settings_tab, text="Clear Search Cache", command=self.clear_cache, style='TButtonRed.TButton')
+        self.clear_cache_button.grid(row=8, column=1, padx=10, pady=5, sticky='w')
+
+        self.scoring_mode_label = ttk.Label(self.settings_tab, text="Scoring Mode:", font=('Helvetica', int(self.settings.get("FONT_SIZE", 10))))
+        self.scoring_mode_label.grid(row=9, column=0, padx=10, pady=5, sticky='w')
+        self.scoring_mode_combo = ttk.Combobox(self.settings_tab, values=("search", "metadata"), state='readonly')
+        self.scoring_mode_combo.set(self.settings.get("SCORING_MODE", SCORING_MODE))
+        self.scoring_mode_combo.grid(row=9, column=1, padx=10, pady=5, sticky='w')
+
+        self.delivery_chunk_size_label = ttk.Label(self.settings_tab, text="Delivery Chunk Size:", font=('Helvetica', int(self.settings.get("FONT_SIZE", 10))))
+        self.delivery_chunk_size_label.grid(row=10, column=0, padx=10, pady=5, sticky='w')
+        self.delivery_chunk_size_entry = ttk.Entry(self.settings_tab, style='Dark.TEntry')
+        self.delivery_chunk_size_entry.insert(0, str(int(self.settings.get("DELIVERY_CHUNK_SIZE", DELIVERY_CHUNK_SIZE))))
+        self.delivery_chunk_size_entry.grid(row=10, column=1, padx=10, pady=5)
+
+        self.early_delivery_var = tk.BooleanVar(value=self.settings.get("EARLY_DELIVERY", str(EARLY_DELIVERY)) == "True")
+        self.early_delivery_check = ttk.Checkbutton(self.settings_tab, text="Send files as soon as their place in the top is certain (early files are not in rank order)", variable=self.early_delivery_var)
+        self.early_delivery_check.grid(row=11, column=1, padx=10, pady=5, sticky='w')
+
+        self.search_planner_label = ttk.Label(self.settings_tab, text="Search Planner:", font=('Helvetica', int(self.settings.get("FONT_SIZE", 10))))
+        self.search_planner_label.grid(row=12, column=0, padx=10, pady=5, sticky='w')
+        self.search_planner_combo = ttk.Combobox(self.settings_tab, values=("off", "exact", "approximate"), state='readonly')
+        self.search_planner_combo.set(self.settings.get("SEARCH_PLANNER", SEARCH_PLANNER))
+        self.search_planner_combo.grid(row=12, column=1, padx=10, pady=5, sticky='w')
+
+        self.seen_files_label = ttk.Label(self.settings_tab, text="Files Already Sent:", font=('Helvetica', int(self.settings.get("FONT_SIZE", 10))))
+        self.seen_files_label.grid(row=13, column=0, padx=10, pady=5, sticky='w')
+        self.seen_files_combo = ttk.Combobox(self.settings_tab, values=("off", "exclude", "demote"), state='readonly')
+        self.seen_files_combo.set(self.settings.get("SEEN_FILES", SEEN_FILES))
+        self.seen_files_combo.grid(row=13, column=1, padx=10, pady=5, sticky='w')
+
+        self.clear_seen_button = ttk.Button(self.settings_tab, text="Forget Sent Files", command=self.clear_seen, style='TButtonRed.TButton')
+        self.clear_seen_button.grid(row=14, column=1, padx=10, pady=5, sticky='w')
+
+        self.early_stop_var = tk.BooleanVar(value=self.settings.get("EARLY_STOP", str(EARLY_STOP)) == "True")
+        self.early_stop_check = ttk.Checkbutton(self.settings_tab, text="Stop searching once the top files are certain", variable=self.early_stop_var)
+        self.early_stop_check.grid(row=15, column=1, padx=10, pady=5, sticky='w')
+
+        self.search_scope_label = ttk.Label(self.settings_tab, text="Search Scope:", font=('Helvetica', int(self.settings.get("FONT_SIZE", 10))))
+        self.search_scope_label.grid(row=16, column=0, padx=10, pady=5, sticky='w')
+        self.search_scope_combo = ttk.Combobox(self.settings_tab, values=("full", "local"), state='readonly')
+        self.search_scope_combo.set(self.settings.get("SEARCH_SCOPE", SEARCH_SCOPE))
+        self.search_scope_combo.grid(row=16, column=1, padx=10, pady=5, sticky='w')
+
+        self.import_merge_label = ttk.Label(self.settings_tab, text="Import Existing Tags:", font=('Helvetica', int(self.settings.get("FONT_SIZE", 10))))
+        self.import_merge_label.grid(row=17, column=0, padx=10, pady=5, sticky='w')
+        self.import_merge_combo = ttk.Combobox(self.settings_tab, values=tuple(MERGE_UPDATES), state='readonly')
+        self.import_merge_combo.set(self.settings.get("IMPORT_MERGE", IMPORT_MERGE))
+        self.import_merge_combo.grid(row=17, column=1, padx=10, pady=5, sticky='w')
+
+        # Extra hydrus clients, Execute searches all of them and the one above at the same time
+        self.clients_label = ttk.Label(self.settings_tab, text="More Clients:", font=('Helvetica', int(self.settings.get("FONT_SIZE", 10))))
+        self.clients_label.grid(row=18, column=0, padx=10, pady=5, sticky='w')
+        self.clients_combo = ttk.Combobox(self.settings_tab, state='readonly')
+        self.clients_combo.grid(row=18, column=1, padx=10, pady=5, sticky='w')
+        self.add_client_button = ttk.Button(self.settings_tab, text="Add Client", command=self.add_client, style='TButtonGreen.TButton')
+        self.add_client_button.grid(row=18, column=2, padx=10, pady=5, sticky='w')
+        self.remove_client_button = ttk.Button(self.settings_tab, text="Remove Client", command=self.remove_client, style='TButtonRed.TButton')
+        self.remove_client_button.grid(row=18, column=3, padx=10, pady=5, sticky='w')
+        self.load_client_list()
+
+        self.client_ranking_label = ttk.Label(self.settings_tab, text="Client Ranking:", font=('Helvetica', int(self.settings.get("FONT_SIZE", 10))))
+        self.client_ranking_label.grid(row=19, column=0, padx=10, pady=5, sticky='w')
+        self.client_ranking_combo = ttk.Combobox(self.settings_tab, values=("separate", "merged"), state='readonly')
+        self.client_ranking_combo.set(self.settings.get("CLIENT_RANKING", CLIENT_RANKING))
+        self.client_ranking_combo.grid(row=19, column=1, padx=10, pady=5, sticky='w')
+
+        # More tabs of the shown profile, filled from the same searches as its own tab
+        self.outputs_label = ttk.Label(self.settings_tab, text="More Outputs:", font=('Helvetica', int(self.settings.get("FONT_SIZE", 10))))
+        self.outputs_label.grid(row=20, column=0, padx=10, pady=5, sticky='w')
+        self.outputs_combo = ttk.Combobox(self.settings_tab, state='readonly')
+        self.outputs_combo.grid(row=20, column=1, padx=10, pady=5, sticky='w')
+        self.add_output_button = ttk.Button(self.settings_tab, text="Add Output", command=self.add_output, style='TButtonGreen.TButton')
+        self.add_output_button.grid(row=20, column=2, padx=10, pady=5, sticky='w')
+        self.remove_output_button = ttk.Button(self.settings_tab, text="Remove Output", command=self.remove_output, style='TButtonRed.TButton')
+        self.remove_output_button.grid(row=20, column=3, padx=10, pady=5, sticky='w')
+        self.load_output_list()
+
+        # History Tab
+        self.history_tab = ttk.Frame(self.notebook)
+        self.notebook.add(self.history_tab, text="History")
+
+        # Past runs on top, the searches of the selected run below
+        history_columns = ("Started", "Mode", "Status", "Searches", "Cached", "Files", "Sent", "Search s", "Sort s", "Delivery s", "Total s")
+        self.history_tree = ttk.Treeview(self.history_tab, columns=history_columns, show='headings', height=8)
+        for col in history_columns:
+            self.history_tree.heading(col, text=col, command=lambda col=col: self.sort_column(col, tree=self.history_tree))
+            self.history_tree.column(col, width=140 if col == "Started" else 70)
+        self.history_tree.pack(fill='x')
+        self.history_tree.bind('<<TreeviewSelect>>', self.show_run_searches)
+
+        self.searches_tree = ttk.Treeview(self.history_tab, columns=("Query", "Seconds", "Files"), show='headings')
+        for col in ("Query", "Seconds", "Files"):
+            self.searches_tree.heading(col, text=col, command=lambda col=col: self.sort_column(col, tree=self.searches_tree))
+            self.searches_tree.column(col, width=400 if col == "Query" else 80)
+        self.searches_tree.pack(expand=1, fill='both')
+
+        # Results of the last Execute per profile, so the next one only searches what changed
+        self.rankings = {}
+        self.client_rankings = {}  # profile -> client name -> RankingState, when there are more clients
+
+        # Hydrus client of this session, made again only when the connection settings change
+        self.client = None
+        self.client_settings = None
+        self.extra_clients = {}  # (api_url, access_key, workers) -> client of the More Clients setting
+
+        # Pending debounced commit of score changes
+        self.commit_after_id = None
+
+        # Background archiver run
+        self.archiver_thread = None
+        self.archiver_messages = queue.Queue()
+        self.archiver_cancel = threading.Event()
+
+        # Load initial data once the window is on screen, the tag rows on a thread. Adding tags waits for them
+        self.exit_after_startup = exit_after_startup
+        self.add_button.config(state='disabled')
+        self.import_button.config(state='disabled')
+        self.after_idle(self.on_first_paint)
+
+    def on_first_paint(self):
+        self.update_idletasks()
+        self.window_shown_after = time.perf_counter() - STARTED
+        self.status_label.config(text="Loading tags...")
+        self.load_profile_list()
+        profile = self.profile
+        model = TagTableModel()
+
+        def build_model():
+            model.load(load_database_contents(profile))
+            model.sort("Score", True)
+
+        thread = threading.Thread(target=build_model, daemon=True)
+        thread.start()
+        self.load_history()
+        self.after(10, self.finish_loading, thread, model, profile)
+
+    def finish_loading(self, thread, model, profile):
+        if thread.is_alive():
+            self.after(10, self.finish_loading, thread, model, profile)
+            return
+        if profile == self.profile:
+            # another profile picked meanwhile was loaded by switch_profile already
+            self.model = model
+            self.model.set_filter(self.filter_var.get())
+            self.set_initial_focus()
+            self.sort_column("Score", reverse=True)
+        self.add_button.config(state='normal')
+        self.import_button.config(state='normal')
+        startup = f"Window after {self.window_shown_after:.2f} s, {len(self.model)} tags after {time.perf_counter() - STARTED:.2f} s"
+        save_setting("STARTUP_TIME", startup)
+        self.status_label.config(text=f"Ready. {startup}.")
+        if self.exit_after_startup:
+            print(startup)
+            self.destroy()
 
     def load_data(self):
-        rows = load_database_contents()
-        for row in rows:
-            self.tree.insert("", "end", values=row)
+        self.load_profile_list()
+        self.model.load(load_database_contents(self.profile))
+        self.model.set_filter(self.filter_var.get())
         self.set_initial_focus()
 
+    def visible_row_count(self):
+        # rows that fit below the heading
+        return max(1, self.tree.winfo_height() // self.row_height - 1)
+
+    def render_rows(self):
+        # Puts the rows of the model that are on screen into the tree, everything else is never drawn
+        view = self.model.view
+        count = self.visible_row_count()
+        self.view_offset = max(0, min(self.view_offset, len(view) - count))
+        self.tree.delete(*self.tree.get_children())
+        for tag in view[self.view_offset:self.view_offset + count]:
+            self.tree.insert("", "end", iid=tag, values=tuple("" if value is None else value for value in self.model.get(tag)))
+        if self.selected_tag is not None and self.tree.exists(self.selected_tag):
+            self.tree.selection_set(self.selected_tag)
+            self.tree.focus(self.selected_tag)
+        if view:
+            self.tree_scrollbar.set(self.view_offset / len(view), min(1.0, (self.view_offset + count) / len(view)))
+        else:
+            self.tree_scrollbar.set(0.0, 1.0)
+
+    def scroll_rows(self, action, amount, unit=None):
+        # Scrollbar and mouse wheel move the window over the model instead of scrolling the tree
+        if action == 'moveto':
+            self.view_offset = int(float(amount) * len(self.model.view))
+        elif unit == 'pages':
+            self.view_offset += int(amount) * self.visible_row_count()
+        else:
+            self.view_offset += int(amount)
+        self.render_rows()
+        return "break"
+
+    def move_selection(self, step):
+        # Arrow and page keys walk through the model, scrolling when the selection leaves the screen
+        view = self.model.view
+        if not view:
+            return "break"
+        try:
+            position = view.index(self.selected_tag) + step if self.selected_tag in self.model else 0
+        except ValueError:
+            position = self.view_offset
+        self.show_tag(view[max(0, min(position, len(view) - 1))])
+        return "break"
+
+    def show_tag(self, tag):
+        # Selects a tag and scrolls it on screen
+        self.selected_tag = tag
+        if tag in self.model.view:
+            position = self.model.view.index(tag)
+            count = self.visible_row_count()
+            if position < self.view_offset:
+                self.view_offset = position
+            elif position >= self.view_offset + count:
+                self.view_offset = position - count + 1
+        self.render_rows()
+
+    def on_tree_select(self, event=None):
+        selected_item = self.tree.selection()
+        if selected_item:
+            self.selected_tag = selected_item[0]
+
+    def selected_row(self):
+        # [tag, score, siblings, comment] of the selected tag, None if nothing is selected
+        if self.selected_tag is None:
+            return None
+        return self.model.get(self.selected_tag)
+
+    def apply_filter(self, *args):
+        self.model.set_filter(self.filter_var.get())
+        self.view_offset = 0
+        if self.selected_tag in self.model.view:
+            self.show_tag(self.selected_tag)
+        else:
+            self.render_rows()
+
+    def load_profile_list(self):
+        profiles = load_profiles()
+        if self.profile not in [profile for profile, tabname, run in profiles]:
+            self.profile = DEFAULT_PROFILE
+        self.profile_combo.config(values=[profile for profile, tabname, run in profiles])
+        self.profile_combo.set(self.profile)
+        self.profile_run_var.set(any(profile == self.profile and run for profile, tabname, run in profiles))
+
+    def profile_tabname(self, profile=None):
+        # the tab a profile is sent to, None for the Tab Name setting
+        profile = self.profile if profile is None else profile
+        for name, tabname, run in load_profiles():
+            if name == profile:
+                return tabname
+        return None
+
+    def switch_profile(self, profile):
+        if self.commit_after_id is not None:
+            self.after_cancel(self.commit_after_id)
+            self.commit_changes()
+        self.profile = profile
+        self.selected_tag = None
+        self.load_output_list()
+        self.load_data()
+        self.sort_column("Score", reverse=True)
+
+    def new_profile(self):
+        # Asking for an existing profile again changes its tab
+        profile = simpledialog.askstring("New Profile", "Profile name:", parent=self)
+        if not profile:
+            return
+        tabname = simpledialog.askstring("New Profile", f"Hydrus tab for '{profile}' (empty uses the Tab Name setting):", initialvalue=profile, parent=self)
+        if tabname is None:
+            return
+        existing = {name: run for name, profile_tab, run in load_profiles()}
+        save_profile(profile, tabname or None, existing.get(profile, 0))
+        self.switch_profile(profile)
+
+    def delete_current_profile(self):
+        if self.profile == DEFAULT_PROFILE:
+            messagebox.showerror("Error", "The default profile can't be deleted.")
+            return
+        if messagebox.askyesno("Confirm", f"Delete the profile '{self.profile}' and all of its tags?"):
+            delete_profile(self.profile)
+            self.rankings.pop(self.profile, None)
+            self.client_rankings.pop(self.profile, None)
+            self.switch_profile(DEFAULT_PROFILE)
+
+    def toggle_profile_run(self):
+        save_profile(self.profile, self.profile_tabname(), self.profile_run_var.get())
+
+    def load_history(self):
+        self.history_tree.delete(*self.history_tree.get_children())
+        for run_id, started_at, *values in load_run_history():
+            started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started_at))
+            values = ["" if value is None else round(value, 2) if isinstance(value, float) else value for value in values]
+            self.history_tree.insert("", "end", iid=str(run_id), values=[started] + values)
+
+    def show_run_searches(self, event=None):
+        # Slowest searches of the selected run first, to find tags that are slow or match huge numbers of files
+        self.searches_tree.delete(*self.searches_tree.get_children())
+        selected_item = self.history_tree.selection()
+        if not selected_item:
+            return
+        for query, seconds, file_count in load_run_searches(int(selected_item[0])):
+            self.searches_tree.insert("", "end", values=(query, round(seconds, 3), file_count))
+
     def set_initial_focus(self):
-        if self.tree.get_children():
-            self.tree.selection_set(self.tree.get_children()[0])
-            self.tree.focus(self.tree.get_children()[0])
+        if self.model.view:
+            self.selected_tag = self.model.view[0]
+        self.view_offset = 0
+        self.render_rows()
 
     def add_tag(self):
         def on_ok():
@@ -325,10 +2708,12 @@ class HydrusFileHighScoreApp(tk.Tk):
             if tag and score:
                 try:
                     score = float(score)
-                    self.tree.insert("", "end", values=(tag, score, siblings, comment))
-                    rows = load_database_contents()
-                    rows.append((tag, score, siblings, comment))
-                    save_database_changes(rows)
+                    if tag in self.model:
+                        messagebox.showerror("Error", f"Tag '{tag}' already exists.")
+                        return
+                    self.model.upsert(tag, score, siblings or None, comment or None)
+                    upsert_tag_score(tag, score, siblings or None, comment or None, profile=self.profile)
+                    self.show_tag(tag)
                     add_window.destroy()
                 except ValueError:
                     messagebox.showerror("Error", "Score must be a number.")
@@ -347,6 +2732,7 @@ class HydrusFileHighScoreApp(tk.Tk):
                 messagebox.showerror("Error", "Score must be a number.")
 
         # Check clipboard content
+        import pyperclip
         clipboard_content = pyperclip.paste()
         if len(clipboard_content) < 80 and " " not in clipboard_content:
             initial_tag = clipboard_content
@@ -401,11 +2787,11 @@ class HydrusFileHighScoreApp(tk.Tk):
         add_window.geometry(f"+{x}+{y}")
 
     def edit_tag(self):
-        selected_item = self.tree.selection()
-        if not selected_item:
+        item_values = self.selected_row()
+        if item_values is None:
             messagebox.showerror("Error", "Please select a tag to edit.")
             return
-        item_values = self.tree.item(selected_item, "values")
+        item_values = list(item_values)
 
         def on_ok():
             tag = tag_entry.get()
@@ -415,10 +2801,14 @@ class HydrusFileHighScoreApp(tk.Tk):
             if tag and score:
                 try:
                     score = float(score)
-                    self.tree.item(selected_item, values=(tag, score, siblings, comment))
-                    rows = load_database_contents()
-                    rows = [row if row[0] != item_values[0] else (tag, score, siblings, comment) for row in rows]
-                    save_database_changes(rows)
+                    if tag != item_values[0] and tag in self.model:
+                        messagebox.showerror("Error", f"Tag '{tag}' already exists.")
+                        return
+                    self.model.upsert(tag, score, siblings or None, comment or None, old_tag=item_values[0])
+                    if tag != item_values[0]:
+                        delete_tag_score(item_values[0], commit=False, profile=self.profile)
+                    upsert_tag_score(tag, score, siblings or None, comment or None, profile=self.profile)
+                    self.show_tag(tag)
                     edit_window.destroy()
                 except ValueError:
                     messagebox.showerror("Error", "Score must be a number.")
@@ -454,7 +2844,7 @@ class HydrusFileHighScoreApp(tk.Tk):
         score_label = ttk.Label(edit_window, text="Score:", font=('Helvetica', int(self.settings.get("FONT_SIZE", 10))))
         score_label.grid(row=1, column=0, padx=10, pady=5, sticky='w')
         score_entry = ttk.Entry(edit_window, style='Dark.TEntry')
-        score_entry.insert(0, item_values[1])
+        score_entry.insert(0, str(DEFAULT_SCORE if item_values[1] is None else item_values[1]))
         score_entry.grid(row=1, column=1, padx=10, pady=5, sticky='ew')
 
         # Add "+" and "-" buttons next to the score entry
@@ -486,16 +2876,18 @@ class HydrusFileHighScoreApp(tk.Tk):
         edit_window.geometry(f"+{x}+{y}")
 
     def delete_tag(self):
-        selected_item = self.tree.selection()
-        if not selected_item:
+        item_values = self.selected_row()
+        if item_values is None:
             messagebox.showerror("Error", "Please select a tag to delete.")
             return
-        item_values = self.tree.item(selected_item, "values")
-        if messagebox.askyesno("Confirm", f"Are you sure you want to delete the tag '{item_values[0]}'?"):
-            self.tree.delete(selected_item)
-            rows = load_database_contents()
-            rows = [row for row in rows if row[0] != item_values[0]]
-            save_database_changes(rows)
+        tag = item_values[0]
+        if messagebox.askyesno("Confirm", f"Are you sure you want to delete the tag '{tag}'?"):
+            # the row below takes over the selection
+            position = self.model.view.index(tag) if tag in self.model.view else 0
+            self.model.remove(tag)
+            delete_tag_score(tag, profile=self.profile)
+            self.selected_tag = self.model.view[min(position, len(self.model.view) - 1)] if self.model.view else None
+            self.render_rows()
 
     def run_archiver(self):
         api_url = self.api_url_entry.get()
@@ -503,18 +2895,261 @@ class HydrusFileHighScoreApp(tk.Tk):
         tabname = self.tab_name_entry.get()
         limit = int(self.limit_entry.get())
         default_score = float(self.default_score_entry.get())
-        client = hydrus_api.Client(access_key=access_key, api_url=api_url)
-        db_high_score_archiver(client, BLACKLIST, WHITELIST, limit, tabname)
+        workers = int(self.search_workers_entry.get())
+        cache_ttl = int(self.search_cache_ttl_entry.get())
+        mode = self.scoring_mode_combo.get()
+        chunk_size = int(self.delivery_chunk_size_entry.get())
+        early_delivery = self.early_delivery_var.get()
+        planner = self.search_planner_combo.get()
+        seen_mode = self.seen_files_combo.get()
+        early_stop = self.early_stop_var.get()
+        scope = self.search_scope_combo.get()
+        client = self.get_client(access_key, api_url, workers)
+
+        pbar = RunProgress(self.archiver_messages, self.archiver_cancel)
+        report = lambda kind, title, message: self.archiver_messages.put((kind, title, message))
+        # Two or more profiles marked to run go together, sharing their searches. Otherwise the shown profile runs
+        profiles = [(profile, profile_tab or tabname) for profile, profile_tab, run in load_profiles() if run]
+        if len(profiles) > 1:
+            skipped = []
+            if mode != "search":
+                skipped.append(f"Scoring Mode {mode}")
+            if early_delivery:
+                skipped.append("sending files early")
+            if early_stop:
+                skipped.append("stopping early")
+            if any(load_outputs(profile) for profile, profile_tab in profiles):
+                skipped.append("More Outputs")
+            if load_clients():
+                skipped.append("More Clients")
+            if self.profile not in [profile for profile, profile_tab in profiles]:
+                skipped.append(f"the shown profile '{self.profile}' (Run on Execute is off)")
+            self.start_background(multi_profile_archiver, (client, BLACKLIST, WHITELIST, limit, profiles, workers, cache_ttl, self.rankings, pbar, report, chunk_size, planner, seen_mode, scope, skipped))
+            return
+        profile, tabname = self.profile, self.profile_tabname() or tabname
+        extra_clients = load_clients()
+        if extra_clients:
+            # every client keeps its own rankings, the shown profile is searched in all of them
+            clients = [("main", client, tabname)]
+            for name, client_url, client_key, client_tab in extra_clients:
+                if (client_url, client_key, workers) not in self.extra_clients:
+                    self.extra_clients[(client_url, client_key, workers)] = create_client(client_key, client_url, workers)
+                clients.append((name, self.extra_clients[(client_url, client_key, workers)], client_tab or tabname))
+            rankings = self.client_rankings.setdefault(profile, {})
+            skipped = []
+            if mode != "search":
+                skipped.append(f"Scoring Mode {mode}")
+            if early_delivery:
+                skipped.append("sending files early")
+            if early_stop:
+                skipped.append("stopping early")
+            if load_outputs(profile):
+                skipped.append("More Outputs")
+            self.start_background(multi_client_archiver, (clients, BLACKLIST, WHITELIST, limit, workers, rankings, pbar, report, chunk_size, planner, profile, self.client_ranking_combo.get(), scope, cache_ttl, seen_mode, skipped))
+            return
+        ranking = self.rankings.setdefault(profile, RankingState())
+        outputs = load_outputs(profile)
+        self.start_background(db_high_score_archiver, (client, BLACKLIST, WHITELIST, limit, tabname, workers, cache_ttl, mode, ranking, pbar, report, chunk_size, early_delivery, planner, profile, seen_mode, early_stop, scope, outputs))
+
+    def get_client(self, access_key, api_url, workers):
+        if self.client is None or self.client_settings != (access_key, api_url, workers):
+            self.client = create_client(access_key, api_url, workers)
+            self.client_settings = (access_key, api_url, workers)
+        return self.client
+
+    def start_background(self, target, args):
+        # One background job at a time, it reports through archiver_messages
+        if self.archiver_thread is not None and self.archiver_thread.is_alive():
+            messagebox.showinfo("Busy", "The archiver is already running.")
+            return
+        self.archiver_cancel.clear()
+        self.archiver_thread = threading.Thread(target=target, args=args, daemon=True)
+        self.execute_button.config(state='disabled')
+        self.cancel_button.config(state='normal')
+        self.progress_bar.config(value=0, maximum=1)
+        self.status_label.config(text="Running...")
+        self.archiver_thread.start()
+        self.after(100, self.poll_archiver)
+
+    def cancel_archiver(self):
+        self.archiver_cancel.set()
+        self.cancel_button.config(state='disabled')
+        self.status_label.config(text="Cancelling...")
+
+    def poll_archiver(self):
+        # Runs on the Tk thread, shows everything the background run reported since the last poll.
+        # Checking the thread first means a finished run has queued everything we drain below.
+        alive = self.archiver_thread.is_alive()
+        result = None
+        try:
+            while True:
+                message = self.archiver_messages.get_nowait()
+                if message[0] == "progress":
+                    done, total, elapsed = message[1:]
+                    rate = done / elapsed if elapsed > 0 else 0.0
+                    self.progress_bar.config(value=done, maximum=max(total, 1))
+                    self.status_label.config(text=f"{done}/{total} done, {elapsed:.1f} s elapsed, {rate:.1f} per second")
+                elif message[0] == "siblings":
+                    self.apply_siblings(message[1])
+                else:
+                    result = message
+        except queue.Empty:
+            pass
+        if alive:
+            self.after(100, self.poll_archiver)
+            return
+        self.execute_button.config(state='normal')
+        self.cancel_button.config(state='disabled')
+        self.load_history()
+        if result is not None:
+            kind, title, message = result
+            self.status_label.config(text=f"{title}: {message}")
+            if kind != "cancelled":
+                report_with_messagebox(kind, title, message)
+
+    def fill_siblings(self):
+        # Looks up hydrus siblings for every tag with an empty Siblings cell
+        tags = [tag for tag in self.model.order if not self.model.get(tag)[2]]
+        if not tags:
+            messagebox.showinfo("Siblings", "Every tag already has siblings set.")
+            return
+        client = self.get_client(self.access_key_entry.get(), self.api_url_entry.get(), int(self.search_workers_entry.get()))
+        cache_ttl = int(self.search_cache_ttl_entry.get())
+
+        def lookup():
+            try:
+                found = lookup_hydrus_siblings(client, tags, ttl=max(cache_ttl, 1))
+                self.archiver_messages.put(("siblings", found))
+                filled = sum(1 for siblings in found.values() if siblings)
+                self.archiver_messages.put(("info", "Siblings", f"Found siblings for {filled} of {len(tags)} tags."))
+            except Exception as e:
+                self.archiver_messages.put(("error", "Error", str(e)))
+
+        self.start_background(lookup, ())
+
+    def apply_siblings(self, found):
+        for tag, siblings in found.items():
+            row = self.model.get(tag)
+            if row is not None and not row[2] and siblings:
+                self.model.set_siblings(tag, ", ".join(siblings))
+                upsert_tag_score(tag, row[1], row[2], row[3], commit=False, profile=self.profile)
+        commit_database()
+        self.render_rows()
+
+    def load_client_list(self):
+        names = [name for name, api_url, access_key, tabname in load_clients()]
+        self.clients_combo.config(values=names)
+        self.clients_combo.set(names[0] if names else "")
+
+    def add_client(self):
+        # Adding a name again changes that client
+        name = simpledialog.askstring("Add Client", "Name:", parent=self)
+        if not name or name == "main":
+            return
+        api_url = simpledialog.askstring("Add Client", f"API URL of '{name}':", initialvalue=self.api_url_entry.get(), parent=self)
+        if not api_url:
+            return
+        access_key = simpledialog.askstring("Add Client", f"Access key of '{name}':", parent=self)
+        if not access_key:
+            return
+        tabname = simpledialog.askstring("Add Client", f"Tab in '{name}' (empty uses the Tab Name setting):", parent=self)
+        if tabname is None:
+            return
+        save_client(name, api_url, access_key, tabname or None)
+        self.load_client_list()
+        self.clients_combo.set(name)
+
+    def remove_client(self):
+        name = self.clients_combo.get()
+        if name and messagebox.askyesno("Confirm", f"Stop sending runs to the client '{name}'?"):
+            delete_client(name)
+            self.client_rankings.clear()
+            self.load_client_list()
+
+    def load_output_list(self):
+        names = [f"{tabname} ({limit}: {'; '.join(predicates)})" for tabname, limit, predicates in load_outputs(self.profile)]
+        self.outputs_combo.config(values=names)
+        self.outputs_combo.set(names[0] if names else "")
+
+    def add_output(self):
+        # Adding a tab again changes that output
+        tabname = simpledialog.askstring("Add Output", f"Hydrus tab for another output of '{self.profile}':", parent=self)
+        if not tabname:
+            return
+        limit = simpledialog.askinteger("Add Output", f"Files sent to '{tabname}':", initialvalue=int(self.limit_entry.get()), minvalue=1, parent=self)
+        if not limit:
+            return
+        predicates = simpledialog.askstring("Add Output", "Extra predicates, separated by ; (e.g. system:filetype is video; -monochrome):", parent=self)
+        if predicates is None:
+            return
+        save_output(self.profile, tabname, limit, parse_predicates(predicates))
+        self.load_output_list()
 
-    def sort_column(self, col, reverse=False):
-        l = [(self.tree.set(k, col), k) for k in self.tree.get_children('')]
+    def remove_output(self):
+        if not self.outputs_combo.get():
+            return
+        tabname, limit, predicates = load_outputs(self.profile)[self.outputs_combo.current()]
+        if messagebox.askyesno("Confirm", f"Stop filling the tab '{tabname}'?"):
+            delete_output(self.profile, tabname)
+            self.load_output_list()
+
+    def import_tags(self):
+        path = filedialog.askopenfilename(parent=self, title="Import Tags", filetypes=[("Tag scores", "*.csv *.json *.jsonl"), ("All files", "*")])
+        if not path:
+            return
+        if self.commit_after_id is not None:
+            self.after_cancel(self.commit_after_id)
+            self.commit_changes()
+        try:
+            count = import_tag_scores(path, self.import_merge_combo.get(), self.profile)
+        except (OSError, ValueError, csv.Error, sqlite3.Error) as e:
+            messagebox.showerror("Import Failed", f"Nothing was imported: {e}")
+            return
+        self.load_data()
+        self.sort_column("Score", reverse=True)
+        messagebox.showinfo("Import", f"Imported {count} rows into profile '{self.profile}'.")
+
+    def export_tags(self):
+        path = filedialog.asksaveasfilename(parent=self, title="Export Tags", defaultextension=".csv", initialfile=f"{self.profile}.csv", filetypes=[("CSV", "*.csv"), ("JSON", "*.json"), ("JSON Lines", "*.jsonl")])
+        if not path:
+            return
+        if self.commit_after_id is not None:
+            self.after_cancel(self.commit_after_id)
+            self.commit_changes()
+        try:
+            count = export_tag_scores(path, self.profile)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            messagebox.showerror("Export Failed", str(e))
+            return
+        messagebox.showinfo("Export", f"Exported {count} rows of profile '{self.profile}'.")
+
+    def clear_seen(self):
+        if messagebox.askyesno("Confirm", f"Forget which files were sent to the tab of profile '{self.profile}'? They can be sent again by the next run."):
+            clear_seen_files(self.profile)
+
+    def clear_cache(self):
+        if messagebox.askyesno("Confirm", "Clear all cached search results? The next run will search every tag again."):
+            clear_search_cache()
+
+    def sort_column(self, col, reverse=False, tree=None):
+        if tree is None:
+            # the Data tab sorts its model, then draws the top of it. The heading shows which way it is sorted
+            self.model.sort(col, reverse)
+            self.view_offset = 0
+            self.render_rows()
+            for other in TagTableModel.COLUMNS:
+                self.tree.heading(other, text=other)
+            arrow = "\u25bc" if reverse else "\u25b2"
+            self.tree.heading(col, text=f"{col} {arrow}", command=lambda: self.sort_column(col, not reverse))
+            return
+        l = [(tree.set(k, col), k) for k in tree.get_children('')]
         try:
             l.sort(key=lambda t: float(t[0]), reverse=reverse)
         except ValueError:
             l.sort(key=lambda t: t[0], reverse=reverse)
         for index, (val, k) in enumerate(l):
-            self.tree.move(k, '', index)
-        self.tree.heading(col, command=lambda: self.sort_column(col, not reverse))
+            tree.move(k, '', index)
+        tree.heading(col, command=lambda: self.sort_column(col, not reverse, tree))
 
     def increase_score(self, event):
         if event.char == '+':
@@ -525,24 +3160,34 @@ class HydrusFileHighScoreApp(tk.Tk):
             self.adjust_score(-1)
 
     def adjust_score(self, direction):
-        selected_item = self.tree.selection()
-        if not selected_item:
+        item_values = self.selected_row()
+        if item_values is None:
             messagebox.showerror("Error", "Please select a tag to adjust.")
             return
-        item_values = self.tree.item(selected_item, "values")
-        try:
-            score = float(item_values[1])
-            increment = float(self.settings.get("SCORE_INCREMENT", DEFAULT_SCORE_INCREMENT))
-            score += direction * increment
-            score = round(score, 2)  # Round to two decimal places
-            self.tree.item(selected_item, values=(item_values[0], score, item_values[2], item_values[3]))
-            rows = load_database_contents()
-            rows = [row if row[0] != item_values[0] else (item_values[0], score, item_values[2], item_values[3]) for row in rows]
-            save_database_changes(rows)
-        except ValueError:
-            messagebox.showerror("Error", "Score must be a number.")
+        score = DEFAULT_SCORE if item_values[1] is None else item_values[1]
+        increment = float(self.settings.get("SCORE_INCREMENT", DEFAULT_SCORE_INCREMENT))
+        score += direction * increment
+        score = round(score, 2)  # Round to two decimal places
+        self.model.set_score(item_values[0], score)
+        if self.tree.exists(item_values[0]):
+            self.tree.set(item_values[0], "Score", score)
+        upsert_tag_score(item_values[0], score, item_values[2], item_values[3], commit=False, profile=self.profile)
+        self.schedule_commit()
+
+    def schedule_commit(self):
+        # Holding + or - changes a score many times per second, commit once the keys are released
+        if self.commit_after_id is not None:
+            self.after_cancel(self.commit_after_id)
+        self.commit_after_id = self.after(COMMIT_DELAY_MS, self.commit_changes)
+
+    def commit_changes(self):
+        self.commit_after_id = None
+        commit_database()
 
     def on_closing(self):
+        # Stop a running archiver at its next finished search
+        self.archiver_cancel.set()
+        commit_database()
         # Save window size and position
         window_size = self.geometry().split('+')[0]
         window_position = f"+{self.winfo_x()}+{self.winfo_y()}"
@@ -562,13 +3207,43 @@ class HydrusFileHighScoreApp(tk.Tk):
             self.settings.get("SELECTED_TAB", "Data"),
             int(self.settings.get("FONT_SIZE", 14)),
             int(self.settings.get("ENTRY_WIDTH", 40)),
-            self.settings.get("EXAMPLES_POPULATED", "False")  # Pass the flag
+            self.settings.get("EXAMPLES_POPULATED", "False"),  # Pass the flag
+            int(self.search_workers_entry.get()),
+            int(self.search_cache_ttl_entry.get()),
+            self.scoring_mode_combo.get(),
+            int(self.delivery_chunk_size_entry.get()),
+            self.early_delivery_var.get(),
+            self.search_planner_combo.get(),
+            self.profile,
+            self.seen_files_combo.get(),
+            self.early_stop_var.get(),
+            self.search_scope_combo.get(),
+            self.import_merge_combo.get(),
+            self.client_ranking_combo.get()
         )
         self.destroy()
 
 # Run the Application
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Edit tag scores and send the highest scoring files to a hydrus tab.")
+    parser.add_argument("--import", dest="import_path", help="import tag scores from a .csv, .json or .jsonl file instead of opening the window")
+    parser.add_argument("--export", dest="export_path", help="export tag scores to a .csv, .json or .jsonl file instead of opening the window")
+    parser.add_argument("--merge", choices=tuple(MERGE_UPDATES), default=IMPORT_MERGE, help="what an imported tag does to the same tag already in the database")
+    parser.add_argument("--profile", default=DEFAULT_PROFILE, help="profile to import into / export from")
+    parser.add_argument("--measure-startup", action="store_true", help="print how long the window and the tag rows took to show up, then close")
+    args = parser.parse_args()
     initialize_database()
+    if args.import_path or args.export_path:
+        started = time.perf_counter()
+        try:
+            if args.import_path:
+                print(f"Imported {import_tag_scores(args.import_path, args.merge, args.profile)} rows into profile '{args.profile}'")
+            if args.export_path:
+                print(f"Exported {export_tag_scores(args.export_path, args.profile)} rows of profile '{args.profile}'")
+        except (OSError, ValueError, csv.Error, sqlite3.Error) as e:
+            raise SystemExit(f"An error occurred: {e}")
+        print(f"Took {time.perf_counter() - started:.1f} s")
+        raise SystemExit
     examples_populated = load_settings_from_db().get("EXAMPLES_POPULATED", "False")
     if examples_populated == "False":
         example_population()
@@ -587,6 +3262,6 @@ if __name__ == '__main__':
             40,
             "True"  # Set the flag to True after population
         )
-    app = HydrusFileHighScoreApp()
+    app = HydrusFileHighScoreApp(exit_after_startup=args.measure_startup)
     app.protocol("WM_DELETE_WINDOW", app.on_closing)
     app.mainloop()
\ No newline at end of file
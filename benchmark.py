@@ -0,0 +1,318 @@
+"""
+# Benchmark
+Runs the archivers end to end against a fake hydrus client that serves a synthetic library,
+so they can be measured without a running hydrus. Every engine gets the same library and TagScores table.
+
+python benchmark.py --files 100000 --tags 2000 --latency 0.005 --output bench.json
+python benchmark.py --files 100000 --tags 2000 --latency 0.005 --compare bench.json
+
+Results are written as json, --compare reports every number that got worse by more than --tolerance
+compared to an earlier result file and exits with 1 if there was any.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+
+BLACKLIST = ["gore"]
+WHITELIST = ["system:inbox", "system:filetype is animation, image, video"]
+TABNAME = "HFH"
+PROFILES = [("default", TABNAME), ("wallpapers", "wallpapers"), ("characters", "characters")]
+SYSTEM_TAGS = ["system:has audio", "system:has transparency", "system:ratio = 16:9", "system:width = 3,840", "system:height = 2,160"]
+IMPORT_TIME_PATTERN = re.compile(r"^system:import time < (\d+) hours?$")
+
+
+def file_hash(file_id):
+    # fake libraries built with other seeds share files by id, like clients holding the same files do by hash
+    return hashlib.sha256(f"file {file_id}".encode()).hexdigest()
+
+
+class FakeHydrusClient:
+    # Stand-in for hydrus_api.Client with a synthetic library. Tag frequencies follow a power law, a few tags
+    # match a lot of files and most match few. Every request sleeps `latency` seconds like a round trip would.
+    def __init__(self, files=10000, tags=100, latency=0.0, inbox_ratio=0.5, tags_per_file=20, seed=1):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = {}
+        rng = random.Random(seed)
+        self.all_files = frozenset(range(1, files + 1))
+        self.inbox = frozenset(file_id for file_id in self.all_files if rng.random() < inbox_ratio)
+        self.tag_names = [f"tag {i}" for i in range(tags - len(SYSTEM_TAGS))] + SYSTEM_TAGS[:tags]
+        weights = [1.0 / (rank + 1) for rank in range(len(self.tag_names))]
+        scale = files * tags_per_file / sum(weights)
+        self.tag_files = {}
+        for name, weight in zip(self.tag_names, weights):
+            size = min(files, max(1, int(weight * scale)))
+            self.tag_files[name] = frozenset(rng.sample(range(1, files + 1), size))
+        self.tag_files["gore"] = frozenset(rng.sample(range(1, files + 1), max(1, files // 100)))
+        if "system:ratio = 16:9" in self.tag_files:
+            # served sizes are 3840 or 1920 wide and 2160 or 1080 high, 16:9 is whatever matches them
+            wide = self.tag_files.get("system:width = 3,840", frozenset())
+            tall = self.tag_files.get("system:height = 2,160", frozenset())
+            self.tag_files["system:ratio = 16:9"] = frozenset(file_id for file_id in self.all_files if (file_id in wide) == (file_id in tall))
+        self.file_tags = None
+        self.pages = {"pages": [{"name": "other", "page_key": "other-key"}, {"name": TABNAME, "page_key": "hfh-key", "pages": []}]}
+        self.pages["pages"] += [{"name": tabname, "page_key": f"{tabname}-key"} for profile, tabname in PROFILES[1:]]
+        self.page_files = {}
+
+    def count(self, method):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def predicate_files(self, predicate):
+        if isinstance(predicate, list):
+            matched = set()
+            for alternative in predicate:
+                matched.update(self.predicate_files(alternative))
+            return matched
+        if predicate == "system:inbox":
+            return self.inbox
+        if predicate == "system:archive":
+            return self.all_files - self.inbox
+        if predicate.startswith("system:filetype"):
+            return self.all_files
+        match = IMPORT_TIME_PATTERN.match(predicate)
+        if match:
+            # the newest 1% of the library counts as imported within the last hour
+            newest = max(1, len(self.all_files) // 100) * int(match.group(1))
+            return frozenset(range(max(1, len(self.all_files) - newest + 1), len(self.all_files) + 1))
+        return self.tag_files.get(predicate, frozenset())
+
+    def search_files(self, tags, file_sort_type=None, file_sort_asc=None, **kwargs):
+        self.count("search_files")
+        matched = None
+        excluded = set()
+        for predicate in tags:
+            if isinstance(predicate, str) and predicate.startswith("-"):
+                excluded.update(self.predicate_files(predicate[1:]))
+                continue
+            files = self.predicate_files(predicate)
+            matched = set(files) if matched is None else matched & files
+        if matched is None:
+            matched = set(self.all_files)
+        return sorted(matched - excluded)
+
+    def get_file_metadata(self, file_ids=None, **kwargs):
+        self.count("get_file_metadata")
+        with self.lock:
+            if self.file_tags is None:
+                self.file_tags = {}
+                for name, files in self.tag_files.items():
+                    if not name.startswith("system:"):
+                        for file_id in files:
+                            self.file_tags.setdefault(file_id, []).append(name)
+        metadata = []
+        for file_id in file_ids:
+            metadata.append({
+                "file_id": file_id,
+                "hash": file_hash(file_id),
+                "width": 3840 if file_id in self.tag_files.get("system:width = 3,840", ()) else 1920,
+                "height": 2160 if file_id in self.tag_files.get("system:height = 2,160", ()) else 1080,
+                "has_audio": file_id in self.tag_files.get("system:has audio", ()),
+                "has_transparency": file_id in self.tag_files.get("system:has transparency", ()),
+                "is_inbox": file_id in self.inbox,
+                "tags": {"616c6c206b6e6f776e2074616773": {"display_tags": {"0": self.file_tags.get(file_id, [])}}},
+            })
+        return metadata
+
+    def get_pages(self):
+        self.count("get_pages")
+        return self.pages
+
+    def get_page_info(self, page_key, simple=True):
+        import hydrus_api
+        self.count("get_page_info")
+        for page in self.pages["pages"]:
+            if page["page_key"] == page_key:
+                return {"name": page["name"], "page_key": page_key}  # hydrus_api 4 unwraps "page_info"
+        # hydrus answers an unknown page key with 404, which hydrus_api raises as APIError
+        raise hydrus_api.APIError(types.SimpleNamespace(status_code=404, text=f"Could not find page {page_key}"))
+
+    def add_files_to_page(self, page_key, file_ids=None, hashes=None):
+        self.count("add_files_to_page")
+        with self.lock:
+            self.page_files.setdefault(page_key, []).extend(file_ids)
+
+    def focus_page(self, page_key):
+        self.count("focus_page")
+
+    def get_siblings_and_parents(self, tags):
+        self.count("get_siblings_and_parents")
+        return {"services": {}, "tags": {tag: {} for tag in tags}}
+
+
+def populate_tag_scores(client, seed=1):
+    # A TagScores table scoring every tag of the fake library, many rows share a score like real tables do
+    rng = random.Random(seed)
+    scores = [0.1, 0.1, 0.1, 0.2, 0.3, 0.5, -0.1, -0.2, -1.0]
+    return [(name, rng.choice(scores), None, None) for name in client.tag_names]
+
+def populate_profiles(ui, client, seed=1):
+    # The default profile scores every tag, the others each score an overlapping two thirds of them differently
+    rng = random.Random(seed)
+    rows = populate_tag_scores(client, seed)
+    ui.save_database_changes(rows)
+    third = len(rows) // 3
+    for index, (profile, tabname) in enumerate(PROFILES[1:]):
+        ui.save_database_changes([(tag, rng.choice([0.5, 0.2, -0.5]), siblings, comment) for tag, score, siblings, comment in rows[index * third:index * third + 2 * third]], profile)
+
+
+def engine_runs(ui, main, others=()):
+    # name -> function(client, limit, workers) running one engine end to end. others are more fake clients for
+    # the multi client engine, libraries with other seeds sharing file ids (and hashes) with client
+    messages = []
+
+    def report(kind, title, message):
+        messages.append((kind, title, message))
+        if kind == "error":
+            raise RuntimeError(message)
+
+    def ui_run(**options):
+        def run(client, limit, workers):
+            ui.db_high_score_archiver(client, list(BLACKLIST), list(WHITELIST), limit, TABNAME, workers, report=report, **options)
+        return run
+
+    def ui_rerun(**options):
+        # a second run on the same ranking state and a warm search cache, like pressing Execute again
+        def run(client, limit, workers):
+            ranking = ui.RankingState()
+            ui.db_high_score_archiver(client, list(BLACKLIST), list(WHITELIST), limit, TABNAME, workers, ranking=ranking, report=report, **options)
+            client.calls.clear()
+            ui.db_high_score_archiver(client, list(BLACKLIST), list(WHITELIST), limit, TABNAME, workers, ranking=ranking, report=report, **options)
+            if client.calls.get("get_pages"):
+                raise RuntimeError("the cached page key was not used, the page tree was walked again")
+        return run
+
+    def main_rerun(client, limit, workers):
+        # main.py keeps its own page key cache, the second run must not walk the page tree either
+        main.DBHighScoreArchiver(client, list(BLACKLIST), list(WHITELIST), limit, TABNAME, workers, "full")
+        client.calls.clear()
+        main.DBHighScoreArchiver(client, list(BLACKLIST), list(WHITELIST), limit, TABNAME, workers, "full")
+        if client.calls.get("get_pages"):
+            raise RuntimeError("the cached page key was not used, the page tree was walked again")
+
+    return {
+        "main": lambda client, limit, workers: main.DBHighScoreArchiver(client, list(BLACKLIST), list(WHITELIST), limit, TABNAME, workers, "full"),
+        "main-rerun": main_rerun,
+        "main-local-scope": lambda client, limit, workers: main.DBHighScoreArchiver(client, list(BLACKLIST), list(WHITELIST), limit, TABNAME, workers, "local"),
+        "ui-search": ui_run(cache_ttl=0, mode="search", early_delivery=False),
+        "ui-local-scope": ui_run(cache_ttl=0, mode="search", early_delivery=False, scope="local"),
+        "ui-search-serial": lambda client, limit, workers: ui_run(cache_ttl=0, mode="search", early_delivery=False)(client, limit, 1),
+        "ui-early-delivery": ui_run(cache_ttl=0, mode="search", early_delivery=True),
+        "ui-early-stop": ui_run(cache_ttl=0, mode="search", early_delivery=False, early_stop=True),
+        "ui-planner-exact": ui_run(cache_ttl=0, mode="search", planner="exact"),
+        "ui-planner-approximate": ui_run(cache_ttl=0, mode="search", planner="approximate"),
+        "ui-metadata": ui_run(cache_ttl=0, mode="metadata"),
+        "ui-rerun-cached": ui_rerun(cache_ttl=3600, mode="search"),
+        # checkpoints saved all through the search phase while the cache writes its rows, neither may lock the other out
+        "ui-checkpoint-cached": ui_run(cache_ttl=3600, mode="search", early_delivery=False, checkpoint_every=0.001),
+        "ui-outputs": ui_run(cache_ttl=0, mode="search", early_delivery=False, outputs=[("wallpapers", 100, ["system:ratio = 16:9"]), ("characters", 100, ["system:has audio"])]),
+        "ui-clients": lambda client, limit, workers: ui.multi_client_archiver([("main", client, TABNAME)] + [(f"other {index}", other, TABNAME) for index, other in enumerate(others)], list(BLACKLIST), list(WHITELIST), limit, workers, report=report, ranking_mode="merged"),
+        "ui-profiles": lambda client, limit, workers: ui.multi_profile_archiver(client, list(BLACKLIST), list(WHITELIST), limit, PROFILES, workers, cache_ttl=0, report=report),
+    }
+
+
+def run_benchmark(args):
+    # The archivers keep db.db in the working directory, so everything runs in a temporary one
+    workdir = tempfile.mkdtemp(prefix="hfh-bench-")
+    os.chdir(workdir)
+    import HighScoreArchiver_UI as ui
+    import main
+
+    print(f"Building fake library: {args.files} files, {args.tags} tags")
+    client = FakeHydrusClient(args.files, args.tags, args.latency, tags_per_file=args.tags_per_file, seed=args.seed)
+    others = [FakeHydrusClient(args.files, args.tags, args.latency, tags_per_file=args.tags_per_file, seed=args.seed + offset) for offset in (1, 2)]
+    fakes = [client] + others
+    ui.initialize_database()
+    populate_profiles(ui, client, args.seed)
+
+    runs = engine_runs(ui, main, others)
+    selected = args.engines.split(",") if args.engines else list(runs)
+    results = {
+        "config": {"files": args.files, "tags": args.tags, "latency": args.latency, "tags_per_file": args.tags_per_file, "limit": args.limit, "workers": args.workers},
+        "engines": {},
+    }
+    for name in selected:
+        if name not in runs:
+            print(f"Unknown engine {name}, choose from {', '.join(runs)}")
+            continue
+        ui.clear_search_cache()
+        for fake in fakes:
+            fake.calls.clear()
+            fake.page_files.clear()
+        tracemalloc.start()
+        started = time.perf_counter()
+        runs[name](client, args.limit, args.workers)
+        wall_time = time.perf_counter() - started
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        searches = sum(fake.calls.get("search_files", 0) for fake in fakes)
+        results["engines"][name] = {
+            "wall_time": round(wall_time, 4),
+            "searches": searches,
+            "requests": sum(sum(fake.calls.values()) for fake in fakes),
+            "peak_memory": peak_memory,
+            "tags_per_second": round(args.tags / wall_time, 2) if wall_time else None,
+            "delivered": len(client.page_files.get("hfh-key", [])),
+        }
+        print(f"{name:24} {wall_time:8.3f} s  {searches:6} searches  {peak_memory / 2 ** 20:8.1f} MiB peak")
+    return results
+
+
+def compare_results(results, previous, tolerance):
+    # Lists every engine number that got worse than in the previous results by more than tolerance
+    regressions = []
+    if previous.get("config") != results["config"]:
+        print("Warning: the previous results were measured with a different configuration")
+    for name, current in results["engines"].items():
+        before = previous.get("engines", {}).get(name)
+        if before is None:
+            continue
+        for metric in ("wall_time", "searches", "requests", "peak_memory"):
+            if before.get(metric) and current[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f"{name} {metric}: {before[metric]} -> {current[metric]}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the archivers against a fake hydrus client.")
+    parser.add_argument("--files", type=int, default=10000, help="files in the fake library (10k to 5M)")
+    parser.add_argument("--tags", type=int, default=100, help="scored tags (100 to 20k)")
+    parser.add_argument("--tags-per-file", type=int, default=20, help="average tags per file")
+    parser.add_argument("--latency", type=float, default=0.002, help="seconds every fake request takes")
+    parser.add_argument("--limit", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--engines", default="", help="comma separated engines to run, default all")
+    parser.add_argument("--output", default="", help="write the results to this json file")
+    parser.add_argument("--compare", default="", help="json file of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before it counts as regression")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    output = os.path.abspath(args.output) if args.output else ""
+    compare = os.path.abspath(args.compare) if args.compare else ""
+    results = run_benchmark(args)
+    if output:
+        with open(output, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Results written to {output}")
+    if compare:
+        with open(compare) as file:
+            regressions = compare_results(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
@@ -14,11 +14,27 @@ whitelist = ["system:inbox", "system:filetype is animation, image, video"]  # wi
 blacklist = ["gore"]  # will get a - in front of all tags and also added to all queries
 tabname = "HFH"
 limit = 1024
+outputs = [] # more tabs filled from the same tag searches: (tabname, limit, [extra predicates]), e.g. ("HFH videos", 500, ["system:filetype is video"])
 default_score = 0.1 # tags without a score will be tagged with this
+profile = "default" # which TagScores profile is used, the UI can keep several of them
+search_workers = 8 # how many tag searches are sent to hydrus at the same time, 1 searches one tag after another
+search_scope = "full" # "local": tag searches leave out the blacklist / whitelist (except inbox, archive and import time), hydrus checks them once per run and the files are filtered here
+delivery_chunk_size = 256 # files are sent to the tab in pieces of this size
+delivery_retries = 3 # how often a failed piece is sent again
+daemon_interval = 60 * 60 # seconds between refreshes when running with --daemon
 
 # import
 import hydrus_api, hydrus_api.utils # tested with V4.0.0
 import sqlite3
+import heapq
+import time
+import math
+import json
+import hashlib
+import argparse
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 
 def InitializeDatabase():
@@ -46,6 +62,11 @@ def InitializeDatabase():
         else:
             print("Table already exists.")
 
+        # rows belong to a profile, rows from before profiles existed to the default one
+        cmydb.execute("PRAGMA table_info(TagScores)")
+        if 'profile' not in [row[1] for row in cmydb.fetchall()]:
+            cmydb.execute("ALTER TABLE TagScores ADD COLUMN profile TEXT NOT NULL DEFAULT 'default'")
+
         # Commit the changes
         mydb.commit()
     except sqlite3.Error as e:
@@ -69,15 +90,14 @@ def ExamplePopulation():
             ('system:ratio = 16:9', 0.1, None, 'I like files that fit my screen well'),
             ('science fiction', 0.2, None, '*spaceship noises*'),
             ('computer', 0.1, None, 'computer for the win!'),
-            ('monochrome', -0.1, None, 'Why does it burn when I see?'),
-            ('greyscale', -0.1, None, 'Why does it burn when I see?'),
+            ('monochrome', -0.1, 'greyscale', 'Why does it burn when I see?'),
             ('system:has transparency', -0.1, None, 'transparency can be annoying'),
             ('system:width = 3,840', 0.1, None, 'prefer 4k files'),
             ('system:height = 2,160', 0.1, None, 'prefer 4k files')
         ]
 
         # Get existing tags from the database
-        cmydb.execute('SELECT tag FROM TagScores')
+        cmydb.execute("SELECT tag FROM TagScores WHERE profile = 'default'")
         existing_tags = set([row[0] for row in cmydb.fetchall()])
 
         # Filter out tags that already exist
@@ -100,83 +120,217 @@ def ExamplePopulation():
         # Close the connection
         mydb.close()
 
-def DBHighScoreArchiver(client, blacklist, whitelist, limit, tabname="HFH"):
-
-    def find_page_key(tabs, tabname):
-        if 'pages' in tabs and isinstance(tabs['pages'], list):
-            for page in tabs['pages']:
-                if page.get('name') == tabname:
-                    return page.get('page_key')
-                if 'pages' in page and isinstance(page['pages'], list):
-                    sub_page_key = find_page_key(page, tabname)
-                    if sub_page_key:
-                        return sub_page_key
-        return None
-
-    def DisplayFileIDs(tabname, fileIDs, focus=True):
-        client = hydrus_api.Client(access_key=access_key, api_url=api_url)
-        tabs = client.get_pages()
-        page_key = find_page_key(tabs, tabname)
-        if not page_key:
-            print(f"No Tabkey found, you have to create the tab called {tabname}")
-        else:
-            client.add_files_to_page(page_key=page_key, file_ids=fileIDs)
-            if focus:
-                client.focus_page(page_key)
+def TagPredicate(tag, siblings):
+    # siblings is a comma separated list of tags meaning the same, they become one OR search so a file counts once
+    alternatives = [sibling.strip() for sibling in (siblings or "").split(",") if sibling.strip() and sibling.strip() != tag]
+    return [tag] + alternatives if alternatives else tag
+
+def SearchTagsConcurrently(client, queries, workers=search_workers, pbar=None):
+    # runs the searches on a thread pool but yields the results in the order of the queries,
+    # so the scores get added up in the same order as one search after another would do
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(client.search_files, query, file_sort_type=13): index for index, query in enumerate(queries)}
+        finished = {}
+        next_index = 0
+        for future in as_completed(futures):
+            finished[futures[future]] = future.result()
+            if pbar is not None:
+                pbar.update(1)
+            while next_index in finished:
+                yield next_index, finished.pop(next_index)
+                next_index += 1
 
-    # processing blacklist
-    for tag in blacklist:
-        blacklist[blacklist.index(tag)] = "-" + tag
+def find_page_key(tabs, tabname):
+    if 'pages' in tabs and isinstance(tabs['pages'], list):
+        for page in tabs['pages']:
+            if page.get('name') == tabname:
+                return page.get('page_key')
+            if 'pages' in page and isinstance(page['pages'], list):
+                sub_page_key = find_page_key(page, tabname)
+                if sub_page_key:
+                    return sub_page_key
+    return None
 
-    # Retrieve the tags and their manually set scores from the database
+def ResolvePageKey(client, tabname):
+    # The page key found last time is checked with one get_page_info call,
+    # the whole page tree is only walked again if that tab is gone or was renamed
     mydb = sqlite3.connect('db.db')
     cmydb = mydb.cursor()
+    cmydb.execute("CREATE TABLE IF NOT EXISTS PageKeys (tabname TEXT PRIMARY KEY, page_key TEXT)")
+    cmydb.execute("SELECT page_key FROM PageKeys WHERE tabname = ?", (tabname,))
+    row = cmydb.fetchone()
+    page_key = None
+    if row:
+        try:
+            page_info = client.get_page_info(row[0])
+            page_info = page_info.get('page_info', page_info) # hydrus_api 4 returns the inner dict, older versions the whole response
+            if page_info.get('name') == tabname:
+                page_key = row[0]
+        except hydrus_api.APIError:
+            pass  # hydrus restarted or the tab was closed, look it up again
+    if not page_key:
+        page_key = find_page_key(client.get_pages(), tabname)
+        if page_key:
+            cmydb.execute("REPLACE INTO PageKeys (tabname, page_key) VALUES (?, ?)", (tabname, page_key))
+        else:
+            cmydb.execute("DELETE FROM PageKeys WHERE tabname = ?", (tabname,))
+        mydb.commit()
+    mydb.close()
+    return page_key
+
+def CreateClient(access_key, api_url, workers=search_workers):
+    # One client for the whole session, its connections are kept alive and pooled, enough of them for every search worker
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(10, workers))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return hydrus_api.Client(access_key=access_key, api_url=api_url, session=session)
 
-    cmydb.execute('SELECT tag, score FROM TagScores')
+def DisplayFileIDs(client, tabname, fileIDs, focus=True):
+    page_key = ResolvePageKey(client, tabname)
+    if not page_key:
+        print(f"No Tabkey found, you have to create the tab called {tabname}")
+    else:
+        # send in rank order, in pieces so one big request can't time out, retry pieces that fail
+        for chunk in hydrus_api.utils.yield_chunks(fileIDs, delivery_chunk_size):
+            for attempt in range(delivery_retries + 1):
+                try:
+                    client.add_files_to_page(page_key=page_key, file_ids=chunk)
+                    break
+                except Exception:
+                    if attempt == delivery_retries:
+                        raise
+                    time.sleep(0.5 * 2 ** attempt)
+        if focus:
+            client.focus_page(page_key)
+
+def LoadTagScores(profile=profile):
+    # Retrieve the tags and their manually set scores of one profile from the database
+    mydb = sqlite3.connect('db.db')
+    cmydb = mydb.cursor()
+    cmydb.execute('SELECT tag, score, siblings FROM TagScores WHERE profile = ?', (profile,))
     db_tags = cmydb.fetchall()
+    mydb.close()
+    return db_tags
 
+def ScoreTags(client, db_tags, tag_list, workers=search_workers, scope=search_scope):
     # Initialize an empty dictionary to store file IDs and their scores
     ScoreAndIDs = {}
 
+    # With the local scope hydrus resolves the blacklist and whitelist once, the tag queries only get the cheap part
+    base_ids = None
+    query_list = tag_list
+    if scope == "local":
+        base_ids = set(client.search_files(tag_list, file_sort_type=13))
+        query_list = [tag for tag in tag_list if tag.startswith(("system:inbox", "system:archive", "system:import time"))]
+
     # Initialize a progress bar with the total number of iterations
     pbar = tqdm(total=len(db_tags), desc="Processing DB Tags", miniters=10, ncols=80)
 
-    # Loop through each tag in the database
-    tag_list = blacklist + whitelist
-    for tag, score in db_tags:
+    # Build one query per tag, the blacklist and whitelist are added to all of them
+    queries = [[TagPredicate(tag, siblings)] + query_list for tag, score, siblings in db_tags]  # here we can reduce one merge option by doing it earlier
+
+    # Search the tags in parallel, the results come back in the order of db_tags
+    for index, file_ids in SearchTagsConcurrently(client, queries, workers, pbar):
+        score = db_tags[index][1]
         if score is None:
             # Set a manual score for all tags that have no score in the database
             score = default_score
 
-        query = [tag] + tag_list  # here we can reduce one merge option by doing it earlier
-        file_ids = client.search_files(query, file_sort_type=13)  # returns fileids
-
-
         # Store each file ID in the ScoreAndIDs dictionary with the manually set score
         for file_id in file_ids:
+            if base_ids is not None and file_id not in base_ids:
+                continue
             if file_id not in ScoreAndIDs:
                 ScoreAndIDs[file_id] = score
             else:
                 # Increment the score by 0.2 (i.e., add 0.1 to its current score)
                 ScoreAndIDs[file_id] += score
 
-        # Update the progress bar
-        pbar.update(1)
+    pbar.close()
+    return ScoreAndIDs
+
+def DBHighScoreArchiver(client, blacklist, whitelist, limit, tabname="HFH", workers=search_workers, scope=search_scope, outputs=outputs):
+    # processing blacklist, without touching the list that was passed in
+    blacklist = ["-" + tag for tag in blacklist]
+    tag_list = blacklist + whitelist
 
-    # Sort the file IDs by their scores in descending order
+    ScoreAndIDs = ScoreTags(client, LoadTagScores(), tag_list, workers, scope)
 
-    sorted_file_ids = sorted(ScoreAndIDs.items(), key=lambda x: x[1], reverse=True)
+    # Pick the top file IDs by score, nlargest only keeps limit entries around instead of sorting everything
+    top_file_ids = [file_id for file_id, score in heapq.nlargest(limit, ScoreAndIDs.items(), key=lambda x: x[1])]
+    DisplayFileIDs(client, tabname, top_file_ids)
 
-    # Return a list of the top
-    top_file_ids = [file_id for file_id, score in sorted_file_ids[:limit]]
-    DisplayFileIDs(tabname, top_file_ids)
+    # Every other output only needs one search for its predicates, its files are ranked with the scores from above
+    for output_tabname, output_limit, predicates in outputs:
+        allowed = set(client.search_files(tag_list + predicates, file_sort_type=13))
+        output_file_ids = [file_id for file_id, score in heapq.nlargest(output_limit, ((file_id, score) for file_id, score in ScoreAndIDs.items() if file_id in allowed), key=lambda x: x[1])]
+        DisplayFileIDs(client, output_tabname, output_file_ids, focus=False)
     # return [file_id for file_id, score in sorted_file_ids[:limit]]
-    cmydb.close()
+
+def DaemonCycle(client, blacklist, whitelist, limit, tabname="HFH", workers=search_workers):
+    # One refresh of the headless mode. The scores of every file from earlier cycles are kept in DaemonScores.
+    # Only files imported since the last cycle are searched (the tag queries get a system:import time predicate),
+    # unless the tags, scores or lists changed, then everything is scored again.
+    blacklist = ["-" + tag for tag in blacklist]
+    tag_list = blacklist + whitelist
+    db_tags = LoadTagScores()
+    fingerprint = hashlib.sha1(json.dumps([sorted(db_tags, key=str), tag_list, default_score]).encode()).hexdigest()
+
+    mydb = sqlite3.connect('db.db')
+    cmydb = mydb.cursor()
+    cmydb.execute("CREATE TABLE IF NOT EXISTS DaemonScores (file_id INTEGER PRIMARY KEY, score REAL)")
+    cmydb.execute("CREATE INDEX IF NOT EXISTS DaemonScores_score ON DaemonScores (score)")
+    cmydb.execute("CREATE TABLE IF NOT EXISTS DaemonState (key TEXT PRIMARY KEY, value TEXT)")
+    cmydb.execute("SELECT key, value FROM DaemonState")
+    state = dict(cmydb.fetchall())
+    started = time.time()
+
+    if state.get('fingerprint') != fingerprint or 'last_run' not in state:
+        print("Scoring all files")
+        cmydb.execute("DELETE FROM DaemonScores")
+        ScoreAndIDs = ScoreTags(client, db_tags, tag_list, workers)
+    else:
+        # a few minutes of overlap, files scored twice simply get the same score again
+        hours = max(1, math.ceil((started - float(state['last_run']) + 300) / 3600))
+        print(f"Scoring files imported in the last {hours} hours")
+        ScoreAndIDs = ScoreTags(client, db_tags, tag_list + [f"system:import time < {hours} hours"], workers)
+        # drop files that left the whitelist / blacklist selection, e.g. archived ones
+        current_ids = set(client.search_files(tag_list, file_sort_type=13))
+        cmydb.execute("SELECT file_id FROM DaemonScores")
+        gone = [(file_id,) for (file_id,) in cmydb.fetchall() if file_id not in current_ids]
+        cmydb.executemany("DELETE FROM DaemonScores WHERE file_id = ?", gone)
+    cmydb.executemany("REPLACE INTO DaemonScores (file_id, score) VALUES (?, ?)", ScoreAndIDs.items())
+    cmydb.executemany("REPLACE INTO DaemonState (key, value) VALUES (?, ?)", [('fingerprint', fingerprint), ('last_run', str(started))])
+    mydb.commit()
+
+    cmydb.execute("SELECT file_id FROM DaemonScores ORDER BY score DESC LIMIT ?", (limit,))
+    top_file_ids = [row[0] for row in cmydb.fetchall()]
+    mydb.close()
+    DisplayFileIDs(client, tabname, top_file_ids, focus=False)
+    print(f"Refreshed {tabname} with {len(top_file_ids)} files, {len(ScoreAndIDs)} files scored this cycle")
+
+def RunDaemon(client, blacklist, whitelist, limit, tabname="HFH", workers=search_workers, interval=daemon_interval):
+    while True:
+        try:
+            DaemonCycle(client, blacklist, whitelist, limit, tabname, workers)
+        except Exception as e:
+            # hydrus might be closed for a while, try again next cycle
+            print(f"An error occurred: {e}")
+        time.sleep(interval)
 
 
 if __name__ == '__main__':
+    # arguments first, so --help or a typo doesn't create or change db.db
+    parser = argparse.ArgumentParser(description="Send the highest scoring files to a hydrus tab.")
+    parser.add_argument("--daemon", action="store_true", help="keep running and refresh the tab on a schedule, only scoring newly imported files")
+    parser.add_argument("--interval", type=int, default=daemon_interval, help="seconds between refreshes in daemon mode")
+    args = parser.parse_args()
     InitializeDatabase()
     if populate_db_with_examples:
         ExamplePopulation()
-    client = hydrus_api.Client(access_key=access_key, api_url=api_url)
-    DBHighScoreArchiver(client, blacklist, whitelist, limit=1024, tabname=tabname)
\ No newline at end of file
+    client = CreateClient(access_key, api_url, search_workers)
+    if args.daemon:
+        RunDaemon(client, blacklist, whitelist, limit=limit, tabname=tabname, workers=search_workers, interval=args.interval)
+    else:
+        DBHighScoreArchiver(client, blacklist, whitelist, limit=limit, tabname=tabname, workers=search_workers)
\ No newline at end of file